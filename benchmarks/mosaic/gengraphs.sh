@@ -0,0 +1,18 @@
+#!/bin/bash
+
+ba=~/src/benchmark_automation
+
+# data.csv is appended to by mosaic_bench.py, one row per stage and run.
+# We plot the time spent in each stage per commit, one facet per timbre.
+
+env _INPUT_FILE=data.csv \
+	_OUTPUT_FILE=mosaic_stages.png \
+	_X_AXIS=commit \
+	_X_AXIS_LABEL="Commit" \
+	_OUTPUT_RATIO=2 \
+	_Y_AXIS=seconds \
+	_Y_AXIS_LABEL="Time (secs)" \
+	_FACET_X=stage \
+	_FACET_Y=timbre \
+	_AXIS_HAVE_0=yes \
+	_GRAPH_TITLE="mosaic.py: time per pipeline stage" $ba/data_presentation_scripts/csv_to_png.sh
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Reproducible benchmark for the mosaic.py pipeline.
+
+Generates synthetic reference and source signals (so no private audio is
+needed), runs each stage of music/llm-generated/mosaic.py on them and times
+it separately:
+
+- analyze_file: decoding, frame analysis and chunking of every file
+- normalize_features
+- find_best_match: building the matcher (or KD-tree index) and matching
+  every reference chunk
+- pitch_adjust: shifting every matched chunk to its reference pitch
+- concatenate_with_crossfade
+
+Every stage is appended as one row to a CSV file (same long format as the
+other benchmarks in this directory, so gengraphs.sh can plot it) and the
+whole run is also written as JSON. Rows carry the current git commit, so
+results from different commits can be compared.
+
+Usage:
+
+python mosaic_bench.py --reference-seconds 30 --source-seconds 120 \
+    --sources 2 --timbre harmonic noisy --repeat 3 --seed 1
+"""
+
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'music', 'llm-generated'))
+import mosaic  # noqa: E402
+
+STAGES = ['analyze_file', 'normalize_features', 'find_best_match', 'pitch_adjust', 'concatenate_with_crossfade']
+
+CSV_COLUMNS = ['commit', 'date', 'timbre', 'reference_s', 'source_s', 'sources', 'sr', 'extractor', 'index',
+               'repeat', 'stage', 'seconds', 'items', 'items_per_s']
+
+# --- Synthetic Signals ---
+
+def synth_signal(seconds, sr, timbre, rng, note_s=0.25):
+    """
+    Generates a melody of random notes (C3-C6) with the given timbre:
+
+    - sine: pure tones
+    - harmonic: 8 harmonics with 1/k amplitudes (a bright, sawtooth-like tone)
+    - noisy: harmonic tones plus broadband noise
+    - percussive: harmonic tones with a sharp attack and exponential decay
+    """
+    n_samples = int(seconds * sr)
+    note_samples = max(1, int(note_s * sr))
+    n_notes = -(-n_samples // note_samples)
+
+    midi_notes = rng.integers(48, 84, size=n_notes)
+    freqs = np.repeat(440.0 * 2 ** ((midi_notes - 69) / 12.0), note_samples)[:n_samples]
+    phase = 2 * np.pi * np.cumsum(freqs) / sr
+
+    n_harmonics = 1 if timbre == 'sine' else 8
+    y = np.zeros(n_samples)
+    for k in range(1, n_harmonics + 1):
+        y += np.sin(k * phase) / k
+
+    # Loudness varies from note to note
+    y *= np.repeat(rng.uniform(0.2, 1.0, size=n_notes), note_samples)[:n_samples]
+
+    if timbre == 'noisy':
+        y += 0.3 * rng.standard_normal(n_samples)
+    elif timbre == 'percussive':
+        t = np.arange(n_samples) % note_samples / sr
+        y *= np.exp(-t * 12.0)
+    elif timbre not in ('sine', 'harmonic'):
+        raise ValueError(f"Unknown timbre: {timbre}")
+
+    return (0.5 * y / max(1e-9, np.max(np.abs(y)))).astype(np.float32)
+
+def git_commit():
+    """Returns the short hash of the current commit, or 'unknown' outside a git checkout."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# --- Benchmark ---
+
+def run_once(args, timbre, rng, workdir):
+    """Runs the pipeline once on freshly generated signals and returns {stage: (seconds, items)}."""
+    reference_path = os.path.join(workdir, 'reference.wav')
+    sf.write(reference_path, synth_signal(args.reference_seconds, args.sr, timbre, rng), args.sr)
+    source_paths = []
+    for i in range(args.sources):
+        path = os.path.join(workdir, f'source{i}.wav')
+        sf.write(path, synth_signal(args.source_seconds, args.sr, timbre, rng), args.sr)
+        source_paths.append(path)
+
+    results = {}
+
+    start = time.perf_counter()
+    tables = [mosaic.analyze_file(path, args.chunk_size_min, args.chunk_size_max, args.sr, rng=rng, extractor=args.extractor)
+              for path in [reference_path] + source_paths]
+    reference_chunks, source_pool = tables[0], mosaic.ChunkTable.concat(tables[1:], args.sr)
+    results['analyze_file'] = (time.perf_counter() - start, len(reference_chunks) + len(source_pool))
+
+    start = time.perf_counter()
+    mosaic.normalize_features([reference_chunks, source_pool])
+    results['normalize_features'] = (time.perf_counter() - start, len(reference_chunks) + len(source_pool))
+
+    feature_weights = {'rms': 1.0, 'pitch': 1.5, 'mfcc': 1.0, 'duration': 0.5}
+    start = time.perf_counter()
+    if args.index == 'kdtree':
+        matcher = mosaic.SourceIndex(source_pool).configure(feature_weights, True, args.metric)
+    else:
+        matcher = mosaic.SourceMatcher(source_pool, feature_weights, True, args.metric)
+    matches = matcher.best_matches(reference_chunks.norm)
+    results['find_best_match'] = (time.perf_counter() - start, len(reference_chunks))
+
+    start = time.perf_counter()
+    pitch_cache = mosaic.PitchShiftCache(source_pool, quantum=args.pitch_quantum)
+    segments = []
+    for ref_row, src_row in enumerate(matches):
+        ref_pitch_hz, src_pitch_hz = reference_chunks.pitch[ref_row], source_pool.pitch[src_row]
+        if ref_pitch_hz > 0 and src_pitch_hz > 0:
+            segments.append(pitch_cache.request(src_row, 12 * np.log2(ref_pitch_hz / src_pitch_hz)))
+        else:
+            segments.append(source_pool.audio(src_row))
+    results['pitch_adjust'] = (time.perf_counter() - start, pitch_cache.misses)
+
+    start = time.perf_counter()
+    mosaic.concatenate_with_crossfade(segments, 0.01, args.sr)
+    results['concatenate_with_crossfade'] = (time.perf_counter() - start, len(segments))
+
+    return results
+
+def append_csv(path, rows):
+    """Appends rows to a CSV file, writing the header if the file is new."""
+    new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a') as f:
+        if new_file:
+            f.write(','.join(CSV_COLUMNS) + '\n')
+        for row in rows:
+            f.write(','.join(str(row[column]) for column in CSV_COLUMNS) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description="Times each stage of mosaic.py on synthetic audio.")
+    parser.add_argument('--reference-seconds', type=float, default=30.0, help="Length of the synthetic reference. Default: 30")
+    parser.add_argument('--source-seconds', type=float, default=120.0, help="Length of each synthetic source. Default: 120")
+    parser.add_argument('--sources', type=int, default=2, help="Number of source files. Default: 2")
+    parser.add_argument('--timbre', nargs='+', default=['harmonic'], choices=['sine', 'harmonic', 'noisy', 'percussive'], help="Timbres to benchmark, one run each. Default: harmonic")
+    parser.add_argument('--sr', type=int, default=22050, help="Sample rate. Default: 22050")
+    parser.add_argument('--chunk-size-min', type=float, default=0.1, help="Minimum chunk duration in seconds. Default: 0.1")
+    parser.add_argument('--chunk-size-max', type=float, default=0.4, help="Maximum chunk duration in seconds. Default: 0.4")
+    parser.add_argument('--extractor', choices=sorted(mosaic.FEATURE_EXTRACTORS), default=mosaic.DEFAULT_EXTRACTOR, help="Feature extractor to benchmark. Default: %(default)s")
+    parser.add_argument('--metric', choices=['euclidean', 'cosine'], default='euclidean', help="MFCC distance metric. Default: euclidean")
+    parser.add_argument('--index', choices=['none', 'kdtree'], default='none', help="Matcher to benchmark. Default: none (vectorized scan)")
+    parser.add_argument('--pitch-quantum', type=float, default=0.05, help="Semitone rounding for the pitch shift cache. Default: 0.05")
+    parser.add_argument('--repeat', type=int, default=1, help="Number of runs per timbre. Default: 1")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the signals and chunk boundaries. Default: 1")
+    parser.add_argument('--csv', type=str, default='data.csv', help="CSV file to append results to. Default: data.csv")
+    parser.add_argument('--json', type=str, default='results.json', help="JSON file for the full results of this run. Default: results.json")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    date = datetime.datetime.now().isoformat(timespec='seconds')
+    rows = []
+
+    for timbre in args.timbre:
+        for repeat in range(args.repeat):
+            # Same seed per repeat, so every repeat (and every commit) sees the same signals
+            rng = np.random.default_rng([args.seed, repeat])
+            with tempfile.TemporaryDirectory() as workdir:
+                results = run_once(args, timbre, rng, workdir)
+            for stage in STAGES:
+                seconds, items = results[stage]
+                rows.append({
+                    'commit': commit, 'date': date, 'timbre': timbre,
+                    'reference_s': args.reference_seconds, 'source_s': args.source_seconds,
+                    'sources': args.sources, 'sr': args.sr, 'extractor': args.extractor, 'index': args.index,
+                    'repeat': repeat, 'stage': stage, 'seconds': round(seconds, 6), 'items': items,
+                    'items_per_s': round(items / seconds, 3) if seconds > 0 else 0,
+                })
+
+    append_csv(args.csv, rows)
+    with open(args.json, 'w') as f:
+        json.dump({'commit': commit, 'date': date, 'args': vars(args), 'results': rows}, f, indent=2)
+
+    print("\nstage,timbre,seconds,items_per_s")
+    for row in rows:
+        print(f"{row['stage']},{row['timbre']},{row['seconds']},{row['items_per_s']}")
+    print(f"\nResults appended to {args.csv} and written to {args.json}")
+
+if __name__ == '__main__':
+    main()
@@ -29,7 +29,7 @@ Core Concepts:
 
 Dependencies:
 You will need to install the following Python libraries:
-pip install numpy librosa soundfile tqdm
+pip install numpy scipy librosa soundfile tqdm
 
 Usage:
 Save the script as "mosaic.py" and run it from your terminal.
@@ -49,261 +49,2349 @@ python mosaic.py \
 """
 
 import argparse
+import contextlib
+import cProfile
+import csv
+import functools
+import hashlib
+import itertools
+import json
+import os
+import pstats
+import socket
+import sys
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 import numpy as np
 import librosa
 import soundfile as sf
+from scipy.cluster.vq import kmeans2, vq
+from scipy.spatial import cKDTree
 from tqdm import tqdm
 import warnings
-import copy
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak memory is then not reported
+    resource = None
 
 # Suppress annoying librosa warnings about audioread
 warnings.filterwarnings('ignore', category=UserWarning)
 
+# --- Analysis Parameters ---
+# Shared by AudioChunk and the whole-file frame analysis. Changing any of these
+# invalidates the feature cache, because they are part of its key.
+HOP_LENGTH = 512
+# FFT size shared by the RMS and MFCC frames (librosa's default for both).
+N_FFT = 2048
+N_MFCC = 13
+PITCH_FMIN = librosa.note_to_hz('C2')
+PITCH_FMAX = librosa.note_to_hz('C7')
+
+# Column layout of the feature matrices in ChunkTable.
+RMS_COLUMN = 0
+PITCH_COLUMN = 1
+MFCC_COLUMNS = slice(2, 2 + N_MFCC)
+DURATION_COLUMN = 2 + N_MFCC
+N_FEATURES = 3 + N_MFCC
+
 # --- Data Structure for an Audio Chunk ---
 class AudioChunk:
-    """A simple class to hold a chunk of audio and its features."""
-    def __init__(self, audio_data, sample_rate):
+    """
+    A simple class to hold a standalone chunk of audio and its features.
+
+    The pipeline itself stores chunks in a ChunkTable; this class is for
+    analyzing a single piece of audio on its own.
+    """
+    def __init__(self, audio_data, sample_rate, features=None, extractor=None):
         self.audio = audio_data
         self.sr = sample_rate
-        self.features = self._extract_features()
-        # We will add the normalized features later as an attribute
-        self.norm_features = {}
+        self.extractor = extractor or DEFAULT_EXTRACTOR
+        # Features can be passed in when they were already computed from the
+        # frame-level analysis of the whole file (see chunk_features).
+        self.features = features if features is not None else self._extract_features()
 
     def _extract_features(self):
-        """Calculates the acoustic features (fingerprint) of the chunk."""
-        # Use a small hop_length for better temporal resolution in feature extraction
-        hop_length = 512
-
-        # 1. Loudness (RMS Energy)
-        # We take the mean of the RMS values across the chunk.
-        rms = librosa.feature.rms(y=self.audio, hop_length=hop_length)
-        avg_rms = np.mean(rms)
-
-        # 2. Pitch (Fundamental Frequency)
-        # We use the PYIN algorithm to estimate pitch.
-        pitches, _, _ = librosa.pyin(y=self.audio, fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'), sr=self.sr)
-        # Average only the valid (non-NaN) pitch values.
-        avg_pitch = np.nanmean(pitches) if not np.all(np.isnan(pitches)) else 0.0
-
-        # 3. Timbre (MFCCs)
-        # We get a vector of MFCCs and take the mean across the chunk.
-        mfccs = librosa.feature.mfcc(y=self.audio, sr=self.sr, n_mfcc=13, hop_length=hop_length)
-        avg_mfccs = np.mean(mfccs, axis=1)
+        """
+        Calculates the acoustic features (fingerprint) of the chunk.
 
-        return {
-            'rms': float(avg_rms),
-            'pitch': float(avg_pitch),
-            'mfccs': avg_mfccs,
-            'duration': float(len(self.audio))
-        }
+        This runs the same single-pass pipeline that analyze_file uses for
+        whole files (see FEATURE_EXTRACTORS) over the chunk alone, and
+        aggregates all of its frames.
+        """
+        frames = FEATURE_EXTRACTORS[self.extractor].analyze(self.audio, self.sr)
+        return chunk_features(frames, 0, len(self.audio))
+
+# --- Feature Extractors ---
+
+class FeatureExtractor:
+    """
+    A frame-level analysis that can be selected per run (see --extractor).
+
+    analyze(y, sr) returns a dict of float32 arrays with one value per hop of
+    HOP_LENGTH samples, shaped as in FRAME_SHAPES: 'rms', 'pitch' (NaN where
+    unvoiced) and the N_MFCC 'mfccs'. Every extractor produces the same
+    shapes, so chunk aggregation, normalize_features and the matchers work
+    unchanged whichever one computed the frames.
+
+    cost is the analysis time relative to the 'accurate' extractor. The name
+    and params are part of the feature cache key, so frames computed by
+    different extractors (or settings) are never mixed up.
+    """
+    FRAME_SHAPES = {'rms': (), 'pitch': (), 'mfccs': (N_MFCC,)}
+
+    def __init__(self, name, analyze, cost, description, params):
+        self.name = name
+        self.analyze = analyze
+        self.cost = cost
+        self.description = description
+        self.params = params
+
+    def cache_params(self):
+        return [self.name, sorted(self.params.items())]
+
+# Registered extractors by name. HOW TO ADD A NEW EXTRACTOR: write a function
+# that returns frames shaped as in FeatureExtractor.FRAME_SHAPES and decorate
+# it with register_extractor. It can then be selected with --extractor.
+FEATURE_EXTRACTORS = {}
+DEFAULT_EXTRACTOR = 'accurate'
+
+def register_extractor(name, cost, description, **params):
+    """Decorator that adds a frame analysis function to FEATURE_EXTRACTORS."""
+    def register(analyze):
+        FEATURE_EXTRACTORS[name] = FeatureExtractor(name, analyze, cost, description, params)
+        return analyze
+    return register
+
+# --- Frame-Level Analysis ---
+
+def _spectral_frames(y, sr, n_mels):
+    """Returns the RMS and MFCC frames, both computed from one STFT."""
+    stft_magnitude = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+
+    # The spectral RMS includes the energy of the analysis window, so it is
+    # rescaled to the RMS of the unwindowed signal.
+    window = librosa.filters.get_window('hann', N_FFT, fftbins=True)
+    rms = librosa.feature.rms(S=stft_magnitude, frame_length=N_FFT, hop_length=HOP_LENGTH)[0] / np.sqrt(np.mean(window ** 2))
+    mel = librosa.feature.melspectrogram(S=stft_magnitude ** 2, sr=sr, n_mels=n_mels)
+    # No top_db: clipping at 80 dB below the loudest frame would make every
+    # frame depend on the rest of the analyzed audio, so a range, window or
+    # live block would get other MFCCs than the same frames in the whole file.
+    mfccs = librosa.feature.mfcc(S=librosa.power_to_db(mel, top_db=None), n_mfcc=N_MFCC)
+    return rms, mfccs
+
+def _frames_dict(rms, pitches, mfccs):
+    n_frames = min(len(rms), len(pitches), mfccs.shape[1])
+    return {
+        'rms': rms[:n_frames].astype(np.float32),
+        'pitch': pitches[:n_frames].astype(np.float32),
+        'mfccs': mfccs[:, :n_frames].astype(np.float32),
+    }
+
+@register_extractor('accurate', cost=1.0, description="pyin pitch and MFCCs from 128 mel bands")
+def analyze_frames(y, sr):
+    """
+    Computes frame-level features for a whole decoded file in a single pass.
+
+    One STFT is shared by the loudness and timbre features, and pyin runs once
+    over the whole file instead of once per chunk:
+
+    1. Loudness (RMS energy) is derived from the STFT magnitudes.
+    2. Pitch (fundamental frequency) comes from one PYIN track; unvoiced
+       frames are NaN.
+    3. Timbre (MFCCs) is computed from the mel spectrogram of the same STFT.
+
+    Returns a dict of float32 arrays with one value (or, for the MFCCs, one
+    column) per hop of HOP_LENGTH samples. Chunk features are then aggregated
+    from these frames by chunk_features, so the file can be re-chunked without
+    running the analysis again.
+
+    Each frame only depends on the audio around it (the mel power is not
+    clipped relative to the loudest frame), so analyzing a range of the file
+    with a few seconds of context gives the same frames as the whole file.
+
+    Compared with running librosa.feature.rms, librosa.pyin and
+    librosa.feature.mfcc separately on every chunk, per-chunk results agree
+    within these tolerances (measured on 0.1-0.4 s chunks):
+
+    - RMS: within about 20% relative, median about 7%. A separate analysis
+      pads each chunk with silence, which lowers the frames at its edges; here
+      those frames see the neighbouring audio.
+    - MFCCs: median difference about 5% of each coefficient's range across
+      chunks, for the same edge reason. Larger for the shortest chunks, and
+      in quiet passages of a loud file: librosa.feature.mfcc clips each
+      chunk at 80 dB below its own loudest frame, where this floor is fixed.
+    - Pitch: median 0.3% relative, 90% of voiced chunks within 1%. A
+      whole-file pitch track is more stable than one estimated on a short
+      chunk, so a few chunks switch between voiced and unvoiced (pitch 0),
+      and occasional octave errors on short chunks disappear.
+    """
+    rms, mfccs = _spectral_frames(y, sr, n_mels=128)
+    pitches, _, _ = librosa.pyin(y=y, fmin=PITCH_FMIN, fmax=PITCH_FMAX, sr=sr, frame_length=N_FFT, hop_length=HOP_LENGTH)
+    return _frames_dict(rms, pitches, mfccs)
+
+# RMS below which the fast extractor treats a frame as unvoiced (about -60 dBFS).
+FAST_SILENCE_RMS = 1e-3
+
+@register_extractor('fast', cost=0.03, description="YIN pitch and MFCCs from 40 mel bands", n_mels=40,
+                    silence_rms=FAST_SILENCE_RMS)
+def analyze_frames_fast(y, sr):
+    """
+    A cheaper version of analyze_frames, for large corpora or quick previews.
+
+    YIN replaces pyin: it estimates one pitch per frame without pyin's
+    probabilistic voicing decision, so frames are only marked unvoiced when
+    they are close to silent (FAST_SILENCE_RMS). Noisy or unpitched frames
+    therefore get a pitch, where pyin would report none. The MFCCs come from
+    40 instead of 128 mel bands, which smooths the spectral envelope a bit.
+    """
+    rms, mfccs = _spectral_frames(y, sr, n_mels=40)
+    pitches = librosa.yin(y, fmin=PITCH_FMIN, fmax=PITCH_FMAX, sr=sr, frame_length=N_FFT, hop_length=HOP_LENGTH)
+    n_frames = min(len(rms), len(pitches))
+    pitches = np.where(rms[:n_frames] < FAST_SILENCE_RMS, np.nan, pitches[:n_frames])
+    return _frames_dict(rms, pitches, mfccs)
+
+def aggregate_frames(frames, starts, ends):
+    """
+    Aggregates frame-level features over the sample ranges [starts[i], ends[i]).
+
+    Returns a float32 (len(starts), N_FEATURES) matrix in the ChunkTable column
+    layout: the mean RMS, the mean pitch of the voiced frames (0.0 if none),
+    the mean MFCCs and the duration in samples. Running sums over the frames
+    make this a few array operations regardless of the number of chunks.
+
+    Frames near the chunk edges see the neighbouring audio instead of padding,
+    so the values are close to, but not bit-identical with, a separate
+    analysis of the chunk (see analyze_frames for the tolerances).
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    n_frames = len(frames['rms'])
+
+    first = np.minimum(starts // HOP_LENGTH, max(0, n_frames - 1))
+    last = np.clip(-(-ends // HOP_LENGTH), first + 1, max(1, n_frames))
+    counts = (last - first)[:, None]
+
+    def range_sums(values):
+        running = np.zeros((n_frames + 1, values.shape[1]), dtype=np.float64)
+        np.cumsum(values, axis=0, dtype=np.float64, out=running[1:])
+        return running[last] - running[first]
+
+    pitches = frames['pitch'][:, None]
+    voiced = ~np.isnan(pitches)
+    voiced_counts = range_sums(voiced)
+    pitch_sums = range_sums(np.where(voiced, pitches, 0.0))
+
+    features = np.empty((len(starts), N_FEATURES), dtype=np.float32, order='F')
+    features[:, RMS_COLUMN] = (range_sums(frames['rms'][:, None]) / counts)[:, 0]
+    features[:, PITCH_COLUMN] = np.divide(pitch_sums, voiced_counts, out=np.zeros_like(pitch_sums), where=voiced_counts > 0)[:, 0]
+    features[:, MFCC_COLUMNS] = range_sums(frames['mfccs'].T) / counts
+    features[:, DURATION_COLUMN] = ends - starts
+    return features
+
+def chunk_features(frames, start, end):
+    """
+    Aggregates the frame-level features of the samples [start, end) into the
+    same feature dict that AudioChunk._extract_features returns.
+    """
+    row = aggregate_frames(frames, [start], [end])[0].astype(np.float64)
+    return {
+        'rms': float(row[RMS_COLUMN]),
+        'pitch': float(row[PITCH_COLUMN]),
+        'mfccs': row[MFCC_COLUMNS],
+        'duration': float(row[DURATION_COLUMN])
+    }
+
+# --- Columnar Chunk Store ---
+
+class ChunkTable:
+    """
+    Struct-of-arrays store for analyzed chunks.
+
+    Instead of one AudioChunk per chunk, with its own audio slice and feature
+    dicts, a table holds:
+
+    - buffers: the decoded audio of each file, shared by all of its chunks.
+      A buffer is either an array or the path of a DecodedAudioStore entry,
+      which is memory-mapped the first time one of its chunks is read.
+    - file_ids, starts, lengths: where each chunk lives in those buffers.
+    - features: a float32 (n_chunks, N_FEATURES) matrix of raw features
+      (RMS, pitch, the MFCCs and duration, see the *_COLUMN constants). It is
+      stored column-major, so each feature is one contiguous array.
+    - norm: the normalized features in the same layout, set by
+      normalize_features.
+
+    Normalization, matching and synthesis work on these arrays directly.
+    """
+    def __init__(self, sr, buffers, file_ids, starts, lengths, features):
+        self.sr = sr
+        self.buffers = list(buffers)
+        self.file_ids = np.asarray(file_ids, dtype=np.int32)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.features = np.asfortranarray(np.asarray(features, dtype=np.float32).reshape(-1, N_FEATURES))
+        self.norm = None
+        self._mapped = {}
+
+    def __getstate__(self):
+        # Memory maps are reopened from their paths after unpickling.
+        state = self.__dict__.copy()
+        state['_mapped'] = {}
+        return state
+
+    @classmethod
+    def empty(cls, sr):
+        return cls(sr, [], [], [], [], np.zeros((0, N_FEATURES), dtype=np.float32))
+
+    @classmethod
+    def from_frames(cls, buffer, sr, frames, boundaries):
+        """Builds the table of one decoded file (an array or a store path) from its frames and chunk boundaries."""
+        bounds = np.asarray(boundaries, dtype=np.int64).reshape(-1, 2)
+        starts, ends = bounds[:, 0], bounds[:, 1]
+        return cls(sr, [buffer], np.zeros(len(bounds)), starts, ends - starts, aggregate_frames(frames, starts, ends))
+
+    @classmethod
+    def concat(cls, tables, sr):
+        """Concatenates tables (e.g. one per source file) into a single pool."""
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return cls.empty(sr)
+
+        buffers, file_ids = [], []
+        for table in tables:
+            file_ids.append(table.file_ids + len(buffers))
+            buffers.extend(table.buffers)
+        pool = cls(sr, buffers, np.concatenate(file_ids), np.concatenate([t.starts for t in tables]),
+                   np.concatenate([t.lengths for t in tables]), np.concatenate([t.features for t in tables]))
+        if all(t.norm is not None for t in tables):
+            pool.norm = np.asfortranarray(np.concatenate([t.norm for t in tables]))
+        return pool
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def rms(self):
+        return self.features[:, RMS_COLUMN]
+
+    @property
+    def pitch(self):
+        return self.features[:, PITCH_COLUMN]
+
+    @property
+    def mfccs(self):
+        return self.features[:, MFCC_COLUMNS]
+
+    @property
+    def duration(self):
+        return self.features[:, DURATION_COLUMN]
+
+    def buffer(self, file_id):
+        """Returns the samples of a file, memory-mapping stored files on first use."""
+        buffer = self.buffers[file_id]
+        if isinstance(buffer, str):
+            if file_id not in self._mapped:
+                self._mapped[file_id] = DecodedAudioStore.map(buffer)
+            return self._mapped[file_id]
+        return buffer
+
+    def rows(self, start, stop):
+        """Returns the chunks [start, stop) as a table that shares this table's buffers."""
+        table = ChunkTable(self.sr, self.buffers, self.file_ids[start:stop], self.starts[start:stop],
+                           self.lengths[start:stop], self.features[start:stop])
+        if self.norm is not None:
+            table.norm = np.asfortranarray(self.norm[start:stop])
+        table._mapped = self._mapped
+        return table
+
+    def audio(self, i):
+        """Returns the audio of chunk i (a view into its file's buffer)."""
+        start = self.starts[i]
+        return self.buffer(self.file_ids[i])[start:start + self.lengths[i]]
+
+# --- Feature Cache ---
+
+@functools.lru_cache(maxsize=1024)
+def _file_hash(filepath, mtime_ns, size, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_hash(filepath):
+    """
+    Returns the SHA-256 of the file contents. The result is remembered until
+    the file's size or modification time changes, so the feature cache and the
+    audio store can both key on it without reading the file twice.
+    """
+    stat = os.stat(filepath)
+    return _file_hash(os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+
+class FeatureCache:
+    """
+    On-disk cache of frame-level features, one uncompressed .npz file per
+    analyzed file.
+
+    Entries are keyed by the file content hash, the sample rate and the
+    analysis parameters, so renaming a file keeps its entry while editing it
+    or changing the analysis settings does not reuse stale features. Chunk
+    sizes are not part of the key: chunks are cut from the cached frames.
+    """
+    VERSION = 4
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, filepath, sample_rate, extractor=DEFAULT_EXTRACTOR):
+        params = [self.VERSION, file_hash(filepath), sample_rate, N_FFT, HOP_LENGTH, N_MFCC, PITCH_FMIN, PITCH_FMAX,
+                  FEATURE_EXTRACTORS[extractor].cache_params()]
+        return hashlib.sha256(json.dumps(params).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, key):
+        """Returns the cached frames for key, or None on a miss."""
+        try:
+            with np.load(self._path(key)) as data:
+                return {name: data[name] for name in ('rms', 'pitch', 'mfccs')}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, key, frames):
+        # Write to a temporary file first so readers never see a partial entry.
+        tmp_path = self._path(key) + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **frames)
+        os.replace(tmp_path, self._path(key))
+
+# --- Decoded Audio Store ---
+
+class DecodedAudioStore:
+    """
+    Directory of decoded and resampled audio, one raw float32 file per source.
+
+    Each file is decoded once and written as raw samples; after that it is
+    memory-mapped instead of decoded. A ChunkTable built on the store keeps
+    only the path of each file, and chunks are offsets into it, so the
+    operating system reads audio pages only for the chunks that are actually
+    synthesized. This allows source corpora larger than physical memory.
+
+    Entries are keyed by the file content hash and the sample rate.
+    """
+    VERSION = 1
+    DTYPE = np.dtype('<f4')
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+    def key(self, filepath, sample_rate):
+        params = [self.VERSION, file_hash(filepath), sample_rate]
+        return hashlib.sha256(json.dumps(params).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.store_dir, key + '.f32')
+
+    @classmethod
+    def map(cls, path):
+        """Memory-maps a stored file read-only."""
+        if os.path.getsize(path) == 0:
+            # np.memmap cannot map an empty file
+            return np.zeros(0, dtype=cls.DTYPE)
+        return np.memmap(path, dtype=cls.DTYPE, mode='r')
+
+    def open(self, key):
+        """Returns the memory-mapped samples for key, or None if not stored."""
+        try:
+            return self.map(self.path(key))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, y):
+        """Writes decoded samples to the store and returns the path of the entry."""
+        # Write to a temporary file first so readers never see a partial entry.
+        tmp_path = self.path(key) + f'.{os.getpid()}.tmp'
+        np.ascontiguousarray(y, dtype=self.DTYPE).tofile(tmp_path)
+        os.replace(tmp_path, self.path(key))
+        return self.path(key)
 
 # --- Core Functions ---
 
-def analyze_file(filepath, chunk_duration_min_s, chunk_duration_max_s, sample_rate):
-    """Loads an audio file and splits it into variable-sized AudioChunk objects."""
+def plan_chunks(n_samples, sr, chunk_duration_min_s, chunk_duration_max_s, rng=None):
+    """
+    Returns the (start, end) sample boundaries of the variable-sized chunks cut
+    from a file of n_samples. Chunk durations are drawn from rng (default: the
+    global np.random state), so a seeded generator makes them reproducible.
+    """
+    rng = np.random if rng is None else rng
+    min_chunk_samples = int(chunk_duration_min_s * sr)
+
+    boundaries = []
+    current_pos_samples = 0
+    while current_pos_samples < n_samples:
+        # Randomly determine chunk duration for this chunk
+        chunk_duration_s = rng.uniform(chunk_duration_min_s, chunk_duration_max_s)
+        chunk_samples = int(chunk_duration_s * sr)
+
+        start = current_pos_samples
+        end = start + chunk_samples
+
+        # For the last chunk, just take what's left
+        if end >= n_samples:
+            end = n_samples
+
+        # Ensure the chunk is not empty and is of a minimum reasonable size
+        # to avoid issues with feature extraction on tiny slivers of audio.
+        if end - start >= min_chunk_samples:
+            boundaries.append((start, end))
+
+        current_pos_samples = end
+
+    return boundaries
+
+def analyze_file(filepath, chunk_duration_min_s, chunk_duration_max_s, sample_rate, cache=None, rng=None, frames=None,
+                 store=None, extractor=DEFAULT_EXTRACTOR, audio=None):
+    """
+    Loads an audio file and splits it into variable-sized chunks, returned as a
+    ChunkTable (empty if the file could not be analyzed).
+
+    The features are computed once for the whole file by the named extractor
+    (see FEATURE_EXTRACTORS) and aggregated per chunk. If a FeatureCache is
+    given, the frame-level features are read from it when possible and stored
+    in it otherwise. Frames that were already computed (e.g. by analyze_files)
+    can be passed in directly, and so can the audio, already decoded at
+    sample_rate.
+
+    If a DecodedAudioStore is given, the decoded audio is written to it (or,
+    if already stored, memory-mapped instead of decoded) and the returned
+    table refers to the stored file instead of holding the audio in memory.
+    """
     print(f"Analyzing file: {filepath}...")
+    sr = sample_rate
+    y = None
     try:
-        y, sr = librosa.load(filepath, sr=sample_rate)
+        if store is not None:
+            store_key = store.key(filepath, sr)
+            y = store.open(store_key)
+            if y is not None:
+                print(f"Using stored audio for {filepath}")
+        if y is None:
+            y = audio
+        if y is None:
+            y, sr = librosa.load(filepath, sr=sample_rate)
     except Exception as e:
         print(f"Error loading {filepath}: {e}")
-        return []
+        return ChunkTable.empty(sample_rate)
 
-    chunks = []
-    current_pos_samples = 0
-    y_len_samples = len(y)
+    if int(chunk_duration_min_s * sr) == 0:
+        print("Error: Minimum chunk size is too small, resulting in zero samples. Please use a larger value for --chunk-size-min.")
+        return ChunkTable.empty(sr)
 
-    min_chunk_samples = int(chunk_duration_min_s * sr)
-    if min_chunk_samples == 0:
+    if frames is None and cache is not None:
+        cache_key = cache.key(filepath, sr, extractor)
+        frames = cache.load(cache_key)
+        if frames is not None:
+            print(f"Using cached features for {filepath}")
+    if frames is None:
+        frames = FEATURE_EXTRACTORS[extractor].analyze(y, sr)
+        if cache is not None:
+            cache.save(cache_key, frames)
+
+    buffer = y
+    if store is not None:
+        buffer = y.filename if isinstance(y, np.memmap) else store.put(store_key, y)
+
+    boundaries = plan_chunks(len(y), sr, chunk_duration_min_s, chunk_duration_max_s, rng)
+    return ChunkTable.from_frames(buffer, sr, frames, boundaries)
+
+# --- Parallel Analysis ---
+
+# Files longer than this are split into time ranges of this length when
+# analyzing in parallel, so a single long file can keep several workers busy.
+DEFAULT_SPLIT_SECONDS = 60.0
+
+# Extra audio analyzed on each side of a time range, so the frames near the
+# range edges see the same neighbouring audio as a whole-file analysis.
+RANGE_CONTEXT_SECONDS = 2.0
+
+def _split_ranges(filepath, sample_rate, split_s):
+    """
+    Splits a file into hop-aligned (start, end) sample ranges, the last one
+    with end=None. Returns (n_samples, ranges), with n_samples the length of
+    the file at sample_rate, or (None, [(0, None)]) if soundfile cannot read
+    its header.
+    """
+    try:
+        info = sf.info(filepath)
+    except Exception:
+        # Let the worker report the error when it tries to load the file.
+        return None, [(0, None)]
+
+    n_samples = -(-info.frames * sample_rate // info.samplerate)
+    range_samples = max(HOP_LENGTH, int(split_s * sample_rate) // HOP_LENGTH * HOP_LENGTH)
+    ranges = [(start, start + range_samples) for start in range(0, max(1, n_samples), range_samples)]
+    ranges[-1] = (ranges[-1][0], None)
+    return n_samples, ranges
+
+def _analyze_frames_range(filepath, sample_rate, start, end, n_samples, extractor=DEFAULT_EXTRACTOR):
+    """
+    Worker: computes the frames of the samples [start, end) of a file, as they
+    would appear in an analysis of the whole file, and returns them with those
+    samples. Only the range and its context are decoded (see _read_range),
+    unless n_samples is None, in which case the whole file is decoded. Runs in
+    a separate process.
+    """
+    sr = sample_rate
+    y = None
+    if n_samples is None:
+        y, sr = librosa.load(filepath, sr=sample_rate)
+        n_samples = len(y)
+
+    final = end is None or end >= n_samples
+    end = n_samples if final else end
+    first_frame = start // HOP_LENGTH
+    if start >= n_samples:
+        last_frame = first_frame
+    elif final:
+        last_frame = 1 + n_samples // HOP_LENGTH
+    else:
+        last_frame = end // HOP_LENGTH
+
+    if last_frame <= first_frame:
+        return ({'rms': np.zeros(0, np.float32), 'pitch': np.zeros(0, np.float32), 'mfccs': np.zeros((N_MFCC, 0), np.float32)},
+                np.zeros(0, np.float32))
+
+    context = int(RANGE_CONTEXT_SECONDS * sr)
+    context_start = max(0, start - context) // HOP_LENGTH * HOP_LENGTH
+    context_end = n_samples if final else min(n_samples, end + context)
+    if y is None:
+        window = _read_range(filepath, sf.info(filepath), sr, context_start, context_end)
+    else:
+        window = y[context_start:context_end]
+    frames = FEATURE_EXTRACTORS[extractor].analyze(window, sr)
+
+    offset = first_frame - context_start // HOP_LENGTH
+    n_frames = last_frame - first_frame
+    return ({name: values[..., offset:offset + n_frames] for name, values in frames.items()},
+            window[start - context_start:end - context_start])
+
+def analyze_files(filepaths, chunk_duration_min_s, chunk_duration_max_s, sample_rate, cache=None, rng=None,
+                  jobs=1, split_s=DEFAULT_SPLIT_SECONDS, store=None, extractor=DEFAULT_EXTRACTOR):
+    """
+    Analyzes several files and returns one ChunkTable per file, in the order
+    of filepaths.
+
+    With jobs > 1 the frame-level analysis runs in a process pool, and files
+    longer than split_s are split into time ranges analyzed concurrently. Each
+    worker decodes only its range (plus context) and returns its samples, so
+    no file is decoded whole, neither in the workers nor here. Chunk
+    boundaries are always drawn here, in file order, from rng, so the chunks
+    are the same for any number of workers.
+    """
+    if jobs <= 1:
+        return [analyze_file(path, chunk_duration_min_s, chunk_duration_max_s, sample_rate, cache=cache, rng=rng, store=store,
+                             extractor=extractor)
+                for path in filepaths]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # Submit every uncached file (or time range) first, then collect in order.
+        cached_frames, cache_keys, pending = {}, {}, {}
+        for i, path in enumerate(filepaths):
+            if cache is not None:
+                try:
+                    cache_keys[i] = cache.key(path, sample_rate, extractor)
+                except OSError:
+                    cache_keys[i] = None
+                cached_frames[i] = cache.load(cache_keys[i]) if cache_keys[i] else None
+                if cached_frames[i] is not None:
+                    print(f"Using cached features for {path}")
+                    continue
+            n_samples, ranges = _split_ranges(path, sample_rate, split_s)
+            pending[i] = [pool.submit(_analyze_frames_range, path, sample_rate, start, end, n_samples, extractor)
+                          for start, end in ranges]
+
+        for i, path in enumerate(filepaths):
+            frames, audio = cached_frames.get(i), None
+            if frames is None:
+                try:
+                    parts = [future.result() for future in tqdm(pending[i], desc=f"Analyzing {path.split('/')[-1]}")]
+                except Exception as e:
+                    print(f"Error loading {path}: {e}")
+                    results.append(ChunkTable.empty(sample_rate))
+                    continue
+                frames = {name: np.concatenate([part[name] for part, _ in parts], axis=-1) for name in parts[0][0]}
+                audio = np.concatenate([samples for _, samples in parts])
+                if cache_keys.get(i):
+                    cache.save(cache_keys[i], frames)
+            results.append(analyze_file(path, chunk_duration_min_s, chunk_duration_max_s, sample_rate, rng=rng, frames=frames,
+                                        store=store, audio=audio))
+
+    return results
+
+# --- Streaming Analysis ---
+
+# Length of the reference windows decoded at a time in streaming mode.
+DEFAULT_STREAM_WINDOW_SECONDS = 30.0
+
+def _read_range(filepath, info, sample_rate, start, end):
+    """
+    Decodes the samples [start, end) (at sample_rate) of a file as mono float32,
+    reading only that part of the file. Resampling a range instead of the
+    whole file can shift it by a fraction of a sample.
+    """
+    native_start = start * info.samplerate // sample_rate
+    native_end = min(info.frames, -(-end * info.samplerate // sample_rate))
+    with sf.SoundFile(filepath) as f:
+        f.seek(native_start)
+        y = f.read(native_end - native_start, dtype='float32', always_2d=True).mean(axis=1)
+    if info.samplerate != sample_rate:
+        y = librosa.resample(y, orig_sr=info.samplerate, target_sr=sample_rate)
+    return librosa.util.fix_length(y, size=end - start)
+
+def analyze_file_stream(filepath, chunk_duration_min_s, chunk_duration_max_s, sample_rate,
+                        window_s=DEFAULT_STREAM_WINDOW_SECONDS, rng=None, extractor=DEFAULT_EXTRACTOR):
+    """
+    Analyzes a file window by window and returns a ChunkTable with the chunk
+    features but without audio (its buffer is None). This is meant for the
+    reference, whose audio is never part of the output.
+
+    Only one window, plus RANGE_CONTEXT_SECONDS on each side, is decoded at a
+    time, and frames are dropped as soon as every chunk covering them has been
+    aggregated. Apart from the feature rows (64 bytes per chunk), memory use
+    therefore does not depend on the length of the file. The features match
+    analyze_file up to floating point rounding when the file is already at
+    sample_rate, and closely otherwise (see _read_range).
+    """
+    print(f"Analyzing file (streaming): {filepath}...")
+    try:
+        info = sf.info(filepath)
+    except Exception as e:
+        print(f"Error loading {filepath}: {e}")
+        return ChunkTable.empty(sample_rate)
+
+    sr = sample_rate
+    if int(chunk_duration_min_s * sr) == 0:
         print("Error: Minimum chunk size is too small, resulting in zero samples. Please use a larger value for --chunk-size-min.")
-        return []
+        return ChunkTable.empty(sr)
 
-    with tqdm(total=y_len_samples, desc=f"Chunking {filepath.split('/')[-1]}") as pbar:
-        while current_pos_samples < y_len_samples:
-            # Randomly determine chunk duration for this chunk
-            chunk_duration_s = np.random.uniform(chunk_duration_min_s, chunk_duration_max_s)
-            chunk_samples = int(chunk_duration_s * sr)
+    n_samples = int(np.ceil(info.frames * sr / info.samplerate))
+    bounds = np.asarray(plan_chunks(n_samples, sr, chunk_duration_min_s, chunk_duration_max_s, rng), dtype=np.int64).reshape(-1, 2)
+    starts, ends = bounds[:, 0], bounds[:, 1]
+    end_frames = -(-ends // HOP_LENGTH)
+    total_frames = 1 + n_samples // HOP_LENGTH
 
-            start = current_pos_samples
-            end = start + chunk_samples
+    features = np.empty((len(starts), N_FEATURES), dtype=np.float32, order='F')
+    window_samples = max(HOP_LENGTH, int(window_s * sr) // HOP_LENGTH * HOP_LENGTH)
+    context = int(RANGE_CONTEXT_SECONDS * sr)
 
-            # For the last chunk, just take what's left
-            if end >= y_len_samples:
-                end = y_len_samples
+    # Frames from buffer_start on, kept until the chunks covering them are done
+    buffered, buffer_start, done = None, 0, 0
+    for window_start in tqdm(range(0, n_samples, window_samples), desc=f"Analyzing {filepath.split('/')[-1]}"):
+        window_end = min(n_samples, window_start + window_samples)
+        final = window_end >= n_samples
+        context_start = max(0, window_start - context) // HOP_LENGTH * HOP_LENGTH
+        try:
+            y = _read_range(filepath, info, sr, context_start, n_samples if final else min(n_samples, window_end + context))
+        except Exception as e:
+            print(f"Error loading {filepath}: {e}")
+            return ChunkTable.empty(sr)
+        frames = FEATURE_EXTRACTORS[extractor].analyze(y, sr)
 
-            chunk_audio = y[start:end]
-            actual_chunk_len = len(chunk_audio)
+        first_frame = window_start // HOP_LENGTH
+        last_frame = total_frames if final else window_end // HOP_LENGTH
+        offset = first_frame - context_start // HOP_LENGTH
+        frames = {name: values[..., offset:offset + last_frame - first_frame] for name, values in frames.items()}
+        if buffered is not None:
+            frames = {name: np.concatenate([buffered[name], frames[name]], axis=-1) for name in frames}
+        buffered = frames
 
-            # Ensure the chunk is not empty and is of a minimum reasonable size
-            # to avoid issues with feature extraction on tiny slivers of audio.
-            if actual_chunk_len >= min_chunk_samples:
-                chunks.append(AudioChunk(chunk_audio, sr))
+        # Aggregate every chunk whose frames are all buffered
+        ready = len(starts) if final else int(np.searchsorted(end_frames, last_frame, side='right'))
+        if ready > done:
+            shift = buffer_start * HOP_LENGTH
+            features[done:ready] = aggregate_frames(buffered, starts[done:ready] - shift, ends[done:ready] - shift)
+            done = ready
+            if done < len(starts):
+                next_start = starts[done] // HOP_LENGTH
+                buffered = {name: values[..., next_start - buffer_start:] for name, values in buffered.items()}
+                buffer_start = next_start
 
-            pbar.update(actual_chunk_len)
-            current_pos_samples = end
-            
-    return chunks
+    return ChunkTable(sr, [None], np.zeros(len(starts)), starts, ends - starts, features)
 
-def find_best_match(reference_chunk, source_pool, feature_weights, use_duration_match, mfcc_distance_metric):
+def find_best_match(reference_features, source_pool, feature_weights, use_duration_match, mfcc_distance_metric, index=None):
     """
-    Finds the best matching chunk from the source_pool for a given reference_chunk.
+    Finds the best matching chunk from the source_pool (a ChunkTable) for a
+    reference chunk, given as a row of normalized features. Returns the row
+    of the best source chunk.
     
     The "best" match is the one with the smallest weighted distance in the
-    feature space. Duration can be optionally included in this calculation.
+    feature space (see SourceMatcher.distances). Duration can be optionally
+    included in this calculation.
+
+    If a SourceIndex built over source_pool is given, it is queried instead of
+    scanning the whole pool. The index is only rebuilt if the weights changed.
     """
-    best_match = None
-    min_distance = float('inf')
+    reference_features = np.asarray(reference_features).reshape(1, N_FEATURES)
+    if index is not None:
+        matcher = index.configure(feature_weights, use_duration_match, mfcc_distance_metric)
+    else:
+        matcher = SourceMatcher(source_pool, feature_weights, use_duration_match, mfcc_distance_metric)
+    return matcher.best_matches(reference_features)[0]
 
-    # Unpack weights
-    w_rms, w_pitch, w_mfcc = feature_weights['rms'], feature_weights['pitch'], feature_weights['mfcc']
-    w_duration = feature_weights.get('duration', 0.0)
+# --- Vectorized Matching ---
+
+# With --index auto, source pools at least this large are searched with a KD-tree
+# (Euclidean MFCC distance only; cosine pools are always scanned).
+INDEX_AUTO_MIN_CHUNKS = 5000
+
+class SourceMatcher:
+    """
+    Scores reference chunks against a whole source pool at once.
+
+    The normalized source features are taken from the pool's ChunkTable as
+    contiguous arrays, so a reference chunk, or a block of them, is scored
+    against the whole pool with a few array operations instead of a Python
+    loop. Ties resolve to the earliest source chunk.
+    """
+    # Upper bound (in bytes) for the temporary arrays built while scoring a block
+    # of reference chunks. Larger blocks mean fewer, bigger array operations.
+    BLOCK_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, source_pool, feature_weights, use_duration_match, mfcc_distance_metric, mfccs=None):
+        if mfcc_distance_metric not in ('euclidean', 'cosine'):
+            raise ValueError(f"Unknown MFCC distance metric: {mfcc_distance_metric}")
+        if source_pool.norm is None:
+            raise ValueError("The source pool must be normalized (see normalize_features) before matching.")
 
-    # Normalized features from the reference chunk
-    ref_rms = reference_chunk.norm_features['rms']
-    ref_pitch = reference_chunk.norm_features['pitch']
-    ref_mfccs = reference_chunk.norm_features['mfccs']
-    ref_duration = reference_chunk.norm_features['duration']
+        self.source_pool = source_pool
+        self.w_rms, self.w_pitch, self.w_mfcc = feature_weights['rms'], feature_weights['pitch'], feature_weights['mfcc']
+        self.w_duration = feature_weights.get('duration', 0.0)
+        self.use_duration_match = use_duration_match
+        self.mfcc_distance_metric = mfcc_distance_metric
 
-    for source_chunk in source_pool:
-        # Normalized features from the source chunk
-        src_rms = source_chunk.norm_features['rms']
-        src_pitch = source_chunk.norm_features['pitch']
-        src_mfccs = source_chunk.norm_features['mfccs']
-        src_duration = source_chunk.norm_features['duration']
+        norm = source_pool.norm
+        self.rms = norm[:, RMS_COLUMN]
+        self.pitch = norm[:, PITCH_COLUMN]
+        self.duration = norm[:, DURATION_COLUMN]
+        # Row-major copy, so each chunk's MFCC vector is contiguous. An existing
+        # copy (e.g. in shared memory, see ParallelMatcher) can be passed in.
+        self.mfccs = np.ascontiguousarray(norm[:, MFCC_COLUMNS]) if mfccs is None else mfccs
+        self.mfcc_norms = np.linalg.norm(self.mfccs, axis=1)
+
+    def __len__(self):
+        return len(self.source_pool)
+
+    def _block_size(self):
+        """How many reference chunks to score per block without exceeding BLOCK_BYTES."""
+        row_bytes = max(1, len(self)) * self.mfccs.shape[1] * self.mfccs.itemsize
+        return max(1, self.BLOCK_BYTES // row_bytes)
+
+    def distances(self, reference_features, rows=None):
+        """
+        Returns a (len(reference_features), len(source_pool)) array with the
+        total weighted distance between every reference chunk (a row of
+        normalized features) and every source chunk. If `rows` is given, only
+        those source chunks are scored and the second axis follows the order
+        of `rows`.
+        """
+        reference_features = np.asarray(reference_features)
+        ref_rms = reference_features[:, RMS_COLUMN, None]
+        ref_pitch = reference_features[:, PITCH_COLUMN, None]
+        ref_mfccs = reference_features[:, MFCC_COLUMNS]
+        ref_duration = reference_features[:, DURATION_COLUMN, None]
+
+        if rows is None:
+            rows = slice(None)
+        src_mfccs = self.mfccs[rows]
 
         # --- Feature Distance Calculation ---
         # Calculate distance for scalar features (lower is better)
-        dist_rms = abs(ref_rms - src_rms)
-        dist_pitch = abs(ref_pitch - src_pitch)
-        
+        dist_rms = np.abs(ref_rms - self.rms[rows])
+        dist_pitch = np.abs(ref_pitch - self.pitch[rows])
+
         # --- MFCC (Timbre) Distance Calculation ---
         # This block calculates the distance between the timbre of the reference
         # and source chunks using the selected metric.
         #
         # HOW TO ADD A NEW METRIC:
-        # 1. Add a new `elif mfcc_distance_metric == 'your_metric_name':` block.
+        # 1. Add a new `elif self.mfcc_distance_metric == 'your_metric_name':` block.
         # 2. Implement your distance calculation. The result (`dist_mfcc`) should be
-        #    a single float where 0 means a perfect match and higher values mean a
-        #    worse match.
+        #    an array with one float per (reference, source) pair, where 0 means a
+        #    perfect match and higher values mean a worse match.
         # 3. If you are implementing a SIMILARITY metric (where higher is better, e.g.,
         #    ranging from 0 to 1), you must convert it to a DISTANCE metric. A common
         #    way is `distance = 1 - similarity`.
-        # 4. Add 'your_metric_name' to the `choices` list in the `add_argument` call
-        #    for `--mfcc-distance-metric` in the `main` function.
-        
-        if mfcc_distance_metric == 'euclidean':
+        # 4. Add 'your_metric_name' to the metric check in __init__ and to the
+        #    `choices` list in the `add_argument` call for `--mfcc-distance-metric`
+        #    in the `main` function. SourceIndex only supports the built-in metrics.
+
+        if self.mfcc_distance_metric == 'euclidean':
             # Euclidean distance (L2 norm): Measures the straight-line distance
             # between the two MFCC vectors in multi-dimensional space.
             # It is sensitive to both magnitude and angle.
-            dist_mfcc = np.linalg.norm(ref_mfccs - src_mfccs)
-        elif mfcc_distance_metric == 'cosine':
+            dist_mfcc = np.linalg.norm(ref_mfccs[:, None, :] - src_mfccs[None, :, :], axis=2)
+        else:
             # Cosine distance: Measures the angle between two vectors, ignoring their
             # magnitude. It's useful for comparing the "shape" of the feature vectors.
             # Cosine SIMILARITY is dot(a,b) / (norm(a)*norm(b)), ranging from -1 to 1.
             # We convert it to a distance metric (ranging from 0 to 2) via `1 - similarity`.
-            norm_ref = np.linalg.norm(ref_mfccs)
-            norm_src = np.linalg.norm(src_mfccs)
-            if norm_ref == 0 or norm_src == 0:
-                # If one vector is all zeros, they are maximally dissimilar.
-                dist_mfcc = 1.0 
-            else:
-                cosine_sim = np.dot(ref_mfccs, src_mfccs) / (norm_ref * norm_src)
-                dist_mfcc = 1 - cosine_sim # Convert similarity to distance.
-        else:
-            # This will catch any metric names that are passed but not implemented.
-            raise ValueError(f"Unknown MFCC distance metric: {mfcc_distance_metric}")
+            norm_ref = np.linalg.norm(ref_mfccs, axis=1)[:, None]
+            norm_prod = norm_ref * self.mfcc_norms[rows]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cosine_sim = (ref_mfccs @ src_mfccs.T) / norm_prod
+            # If one vector is all zeros, they are maximally dissimilar.
+            dist_mfcc = np.where(norm_prod == 0, 1.0, 1 - cosine_sim)
 
         # Calculate the total weighted distance
-        total_distance = (w_rms * dist_rms) + (w_pitch * dist_pitch) + (w_mfcc * dist_mfcc)
+        total_distance = (self.w_rms * dist_rms) + (self.w_pitch * dist_pitch) + (self.w_mfcc * dist_mfcc)
+
+        if self.use_duration_match:
+            total_distance += self.w_duration * np.abs(ref_duration - self.duration[rows])
+
+        return total_distance
+
+    def best_matches(self, reference_features, progress=False):
+        """
+        Returns the row of the best matching source chunk for each row of
+        normalized reference features, in order (-1 if the pool is empty).
+        """
+        reference_features = np.asarray(reference_features)
+        if not len(self):
+            return np.full(len(reference_features), -1, dtype=np.int64)
+
+        block_size = self._block_size()
+        matches = np.empty(len(reference_features), dtype=np.int64)
+        with tqdm(total=len(reference_features), desc="Finding best matches", disable=not progress) as pbar:
+            for block_start in range(0, len(reference_features), block_size):
+                block = reference_features[block_start:block_start + block_size]
+                # np.argmin returns the first minimum, so ties go to the earliest source chunk
+                matches[block_start:block_start + len(block)] = np.argmin(self.distances(block), axis=1)
+                pbar.update(len(block))
+        return matches
 
-        if use_duration_match:
-            dist_duration = abs(ref_duration - src_duration)
-            total_distance += (w_duration * dist_duration)
+class SourceIndex:
+    """
+    KD-tree index over the weighted feature space of a source pool.
+
+    Each source chunk is embedded as a point whose coordinates are its
+    normalized features scaled by their weights (RMS, pitch, the 13 MFCCs and,
+    optionally, duration). The straight-line distance between two points never
+    exceeds the real matching distance, so the tree can discard most of the
+    pool without scoring it:
+
+    1. The nearest points in the tree are scored exactly, giving a best
+       distance D found so far.
+    2. Every chunk that could beat D lies within a radius derived from D, so
+       only the points in that ball are scored exactly.
+
+    With cosine MFCC distance the MFCCs are embedded as unit vectors scaled by
+    sqrt(w_mfcc / 2), so the squared tree distance between them is exactly
+    their weighted cosine distance, and the radius is widened accordingly.
+    The result is identical to SourceMatcher. Exact cosine queries still
+    need much wider balls than Euclidean ones, so --index auto scans instead.
+
+    Setting `approx_candidates` to K > 0 skips step 2 and only re-ranks the K
+    nearest points, which is faster but may miss the true best match. Larger
+    K trades speed for recall.
+
+    The tree depends on the feature weights, so it is only rebuilt by
+    configure() when the weights, metric or duration setting change, or after
+    set_pool() replaces the source pool.
+    """
+    # Number of nearest points scored in step 1 of an exact query.
+    SEED_CANDIDATES = 8
+
+    def __init__(self, source_pool, approx_candidates=0, leafsize=16):
+        self.source_pool = source_pool
+        self.approx_candidates = approx_candidates
+        self.leafsize = leafsize
+        self.matcher = None
+        self.tree = None
+        self._key = None
+
+    def __len__(self):
+        return len(self.source_pool)
+
+    def set_pool(self, source_pool):
+        """Replaces the source pool; the tree is rebuilt on the next configure()."""
+        self.source_pool = source_pool
+        self._key = None
+
+    def configure(self, feature_weights, use_duration_match, mfcc_distance_metric):
+        """Builds the tree for the given weights, unless it was already built for them."""
+        key = (tuple(sorted(feature_weights.items())), bool(use_duration_match), mfcc_distance_metric)
+        if key == self._key:
+            return self
+
+        self.matcher = SourceMatcher(self.source_pool, feature_weights, use_duration_match, mfcc_distance_metric)
+        self.tree = cKDTree(self._embed(self.source_pool.norm), leafsize=self.leafsize) if len(self) else None
+        self._key = key
+        return self
+
+    def _embed(self, features):
+        """Maps rows of normalized features to points in the weighted space. Zero-weight features are dropped."""
+        m = self.matcher
+        features = np.asarray(features, dtype=np.float64)
+        columns = []
+        if m.w_rms:
+            columns.append(m.w_rms * features[:, RMS_COLUMN, None])
+        if m.w_pitch:
+            columns.append(m.w_pitch * features[:, PITCH_COLUMN, None])
+        if m.w_mfcc:
+            mfccs = features[:, MFCC_COLUMNS]
+            if m.mfcc_distance_metric == 'euclidean':
+                columns.append(m.w_mfcc * mfccs)
+            else:
+                # w_mfcc * (1 - cos) is w_mfcc / 2 times the squared distance between unit vectors
+                norms = np.linalg.norm(mfccs, axis=1)[:, None]
+                columns.append(np.sqrt(m.w_mfcc / 2) * np.divide(mfccs, norms, out=np.zeros_like(mfccs), where=norms != 0))
+        if m.use_duration_match and m.w_duration:
+            columns.append(m.w_duration * features[:, DURATION_COLUMN, None])
+        if not columns:
+            # All weights are zero: every chunk is equally good.
+            columns.append(np.zeros((len(features), 1)))
+        return np.hstack(columns)
+
+    def _search_radius(self, best_distance):
+        """Radius in the embedded space that contains every chunk closer than best_distance."""
+        m = self.matcher
+        radius = best_distance
+        if m.mfcc_distance_metric == 'cosine' and m.w_mfcc:
+            # A chunk closer than D has a weighted cosine distance c <= D, which adds c (not c**2)
+            # to the squared tree distance, and other terms that add up to at most (D - c)**2.
+            radius = np.sqrt(np.maximum(best_distance ** 2, best_distance))
+        # Allow for rounding differences between the tree (float64) and the
+        # exact distances (computed on the float32 features).
+        return radius * (1 + 1e-5) + 1e-6
 
-        if total_distance < min_distance:
-            min_distance = total_distance
-            best_match = source_chunk
+    def best_matches(self, reference_features, progress=False):
+        """
+        Returns the row of the best matching source chunk for each row of
+        normalized reference features, in order (-1 if the pool is empty).
+        """
+        if self.matcher is None:
+            raise RuntimeError("SourceIndex.configure() must be called before querying the index.")
+        reference_features = np.asarray(reference_features)
+        if not len(self):
+            return np.full(len(reference_features), -1, dtype=np.int64)
 
-    return best_match
+        queries = self._embed(reference_features)
+        k = min(len(self), self.approx_candidates or self.SEED_CANDIDATES)
+        _, candidates = self.tree.query(queries, k=k)
+        candidates = np.asarray(candidates).reshape(len(reference_features), k)
 
-def normalize_features(all_chunks):
+        matches = np.empty(len(reference_features), dtype=np.int64)
+        for i in tqdm(range(len(reference_features)), desc="Finding best matches", disable=not progress):
+            ref = reference_features[i:i + 1]
+            rows = np.sort(candidates[i])
+            dists = self.matcher.distances(ref, rows)[0]
+            if not self.approx_candidates:
+                radius = self._search_radius(dists.min())
+                rows = np.sort(self.tree.query_ball_point(queries[i], radius))
+                dists = self.matcher.distances(ref, rows)[0]
+            # Rows are sorted, so ties resolve to the earliest source chunk.
+            matches[i] = rows[np.argmin(dists)]
+        return matches
+
+def feature_ranges(tables):
+    """Returns the per-column (min, max) of the raw features over all chunks of the given ChunkTables."""
+    tables = [t for t in tables if len(t)]
+    if not tables:
+        return None
+    return (np.min([t.features.min(axis=0) for t in tables], axis=0),
+            np.max([t.features.max(axis=0) for t in tables], axis=0))
+
+def normalize_features(tables, ranges=None, verbose=True):
     """
-    Normalizes features across all chunks to a [0, 1] range.
+    Normalizes features across all chunks of the given ChunkTables to a [0, 1]
+    range and stores the result in each table's `norm` matrix.
     This is crucial for ensuring that one feature (like MFCC distance)
     doesn't dominate the others in the distance calculation.
+
+    If ranges, a (min, max) pair as returned by feature_ranges, is given, it
+    is used instead of the range of the tables themselves (values outside it
+    then fall outside [0, 1]).
     """
-    print("Normalizing features...")
-    # Extract all values for each feature
-    all_rms = [c.features['rms'] for c in all_chunks]
-    all_pitches = [c.features['pitch'] for c in all_chunks]
-    all_durations = [c.features['duration'] for c in all_chunks]
-    
-    # Min-max normalization for scalar features
-    min_rms, max_rms = min(all_rms), max(all_rms)
-    min_pitch, max_pitch = min(all_pitches), max(all_pitches)
-    min_duration, max_duration = min(all_durations), max(all_durations)
-
-    # For MFCCs, we normalize each coefficient across all chunks
-    all_mfccs = np.array([c.features['mfccs'] for c in all_chunks])
-    min_mfccs = np.min(all_mfccs, axis=0)
-    max_mfccs = np.max(all_mfccs, axis=0)
-    
-    for chunk in tqdm(all_chunks, desc="Applying normalization"):
-        # Handle potential division by zero if all values are the same
-        norm_rms = (chunk.features['rms'] - min_rms) / (max_rms - min_rms) if (max_rms - min_rms) != 0 else 0.5
-        norm_pitch = (chunk.features['pitch'] - min_pitch) / (max_pitch - min_pitch) if (max_pitch - min_pitch) != 0 else 0.5
-        norm_duration = (chunk.features['duration'] - min_duration) / (max_duration - min_duration) if (max_duration - min_duration) != 0 else 0.5
-        # Add a small epsilon to avoid division by zero for MFCCs
-        norm_mfccs = (chunk.features['mfccs'] - min_mfccs) / (max_mfccs - min_mfccs + 1e-9)
-        
-        # CORRECTED: This was assigning an attribute correctly, but the init is now more explicit
-        chunk.norm_features = {
-            'rms': norm_rms,
-            'pitch': norm_pitch,
-            'mfccs': norm_mfccs,
-            'duration': norm_duration
+    if verbose:
+        print("Normalizing features...")
+    tables = [t for t in tables if len(t)]
+    if not tables:
+        return
+
+    # Min-max normalization, per feature (and per MFCC coefficient) across all chunks
+    min_features, max_features = ranges if ranges is not None else feature_ranges(tables)
+    spans = max_features - min_features
+
+    # Add a small epsilon to avoid division by zero for MFCCs
+    denominators = spans.copy()
+    denominators[MFCC_COLUMNS] += 1e-9
+    # Handle potential division by zero if all values of a scalar feature are the same
+    constant = spans == 0
+    constant[MFCC_COLUMNS] = False
+    denominators[constant] = 1.0
+
+    for table in tables:
+        norm = (table.features - min_features) / denominators
+        norm[:, constant] = 0.5
+        table.norm = np.asfortranarray(norm, dtype=np.float32)
+
+# --- Corpus Library ---
+
+class CorpusLibrary:
+    """
+    Persistent library of analyzed source files that can be grown or shrunk
+    one file at a time.
+
+    Each file's chunks (boundaries and raw features) are kept in a shard of
+    their own, and its decoded audio in a DecodedAudioStore inside the library,
+    so adding a file only analyzes that file and removing one only drops its
+    entry. The manifest (library.json) also keeps running statistics per file:
+    the chunk count and the per-column min, max, sum and sum of squares of the
+    raw features. Library-wide statistics are combined from these entries
+    without loading any shard.
+
+    Normalization is applied lazily: pool() returns the stored raw features,
+    and normalize() scales the pool and the reference at query time with the
+    library's min-max range (see normalize_features), so matches do not depend
+    on which reference is queried.
+
+    Only the analysis and the statistics are incremental: there is no
+    persistent index, and no per-file index update. The KD-tree (see
+    make_matcher) is built over features scaled by the library-wide range
+    and the match weights, and adding or removing a file can change that
+    range for every chunk, so it is rebuilt from the pool on every run.
+    That takes about half a second per million chunks.
+
+    The sample rate, chunk sizes and extractor are fixed when the library is
+    created, so all of its chunks are comparable.
+    """
+    VERSION = 1
+    MANIFEST = 'library.json'
+
+    def __init__(self, library_dir, sample_rate=None, chunk_duration_min_s=None, chunk_duration_max_s=None, extractor=None):
+        self.library_dir = library_dir
+        self.manifest_path = os.path.join(library_dir, self.MANIFEST)
+        self.shard_dir = os.path.join(library_dir, 'shards')
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.store = DecodedAudioStore(os.path.join(library_dir, 'audio'))
+
+        requested = {'sr': sample_rate, 'chunk_size_min': chunk_duration_min_s, 'chunk_size_max': chunk_duration_max_s,
+                     'extractor': extractor}
+        if os.path.exists(self.manifest_path):
+            self.refresh()
+            for name, value in requested.items():
+                if value is not None and value != self.settings[name]:
+                    raise ValueError(f"Library {library_dir} was created with {name}={self.settings[name]}, not {value}.")
+        else:
+            defaults = {'sr': 22050, 'chunk_size_min': 0.1, 'chunk_size_max': 0.4, 'extractor': DEFAULT_EXTRACTOR}
+            self.settings = {name: defaults[name] if value is None else value for name, value in requested.items()}
+            self.entries = OrderedDict()
+            self._save_manifest()
+
+        self._tables = {}
+
+    def refresh(self):
+        """Reloads the manifest, e.g. after another process changed the library."""
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != self.VERSION:
+            raise ValueError(f"Unsupported library version in {self.manifest_path}.")
+        self.settings = manifest['settings']
+        self.entries = OrderedDict(manifest['files'])
+
+    def _save_manifest(self):
+        # Write to a temporary file first so readers never see a partial manifest.
+        tmp_path = self.manifest_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.VERSION, 'settings': self.settings, 'files': self.entries}, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _key(self, filepath):
+        # The path is part of the key: copies of a file get chunk boundaries (and shards) of their own.
+        params = [self.VERSION, filepath, file_hash(filepath), self.settings, FeatureCache.VERSION,
+                  FEATURE_EXTRACTORS[self.settings['extractor']].cache_params()]
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _shard_path(self, key):
+        return os.path.join(self.shard_dir, key + '.npz')
+
+    def files(self):
+        return list(self.entries)
+
+    def __len__(self):
+        return sum(entry['chunks'] for entry in self.entries.values())
+
+    def add(self, filepaths, cache=None, rng=None, jobs=1, split_s=DEFAULT_SPLIT_SECONDS):
+        """
+        Analyzes the files that are new or changed since they were added and
+        stores them in the library. Returns the paths that were (re)analyzed.
+        """
+        changed, keys = [], {}
+        for path in dict.fromkeys(os.path.abspath(p) for p in filepaths):
+            try:
+                keys[path] = self._key(path)
+            except OSError as e:
+                print(f"Error loading {path}: {e}")
+                continue
+            if path in self.entries and self.entries[path]['key'] == keys[path]:
+                print(f"Already in library: {path}")
+            else:
+                changed.append(path)
+        if not changed:
+            return []
+
+        tables = analyze_files(changed, self.settings['chunk_size_min'], self.settings['chunk_size_max'], self.settings['sr'],
+                               cache=cache, rng=rng, jobs=jobs, split_s=split_s, store=self.store,
+                               extractor=self.settings['extractor'])
+        added = []
+        for path, table in zip(changed, tables):
+            if not len(table):
+                continue
+            key = keys[path]
+            tmp_path = self._shard_path(key) + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, starts=table.starts, lengths=table.lengths, features=table.features)
+            os.replace(tmp_path, self._shard_path(key))
+
+            features = table.features.astype(np.float64)
+            if path in self.entries:
+                self._drop(path)
+            self.entries[path] = {
+                'key': key,
+                'audio': os.path.relpath(table.buffers[0], self.library_dir),
+                'chunks': len(table),
+                'min': features.min(axis=0).tolist(),
+                'max': features.max(axis=0).tolist(),
+                'sum': features.sum(axis=0).tolist(),
+                'sum_sq': (features ** 2).sum(axis=0).tolist(),
+            }
+            added.append(path)
+        self._save_manifest()
+        return added
+
+    def remove(self, filepaths):
+        """Removes files from the library. Returns the paths that were removed."""
+        removed = [path for path in dict.fromkeys(os.path.abspath(p) for p in filepaths) if path in self.entries]
+        for path in removed:
+            self._drop(path)
+        self._save_manifest()
+        return removed
+
+    def _drop(self, path):
+        entry = self.entries.pop(path)
+        self._tables.pop(entry['key'], None)
+        if os.path.exists(self._shard_path(entry['key'])):
+            os.remove(self._shard_path(entry['key']))
+        # Stored audio is keyed by content, so a copy of the file under another
+        # path may still use it.
+        audio_path = os.path.join(self.library_dir, entry['audio'])
+        if all(other['audio'] != entry['audio'] for other in self.entries.values()) and os.path.exists(audio_path):
+            os.remove(audio_path)
+
+    def stats(self):
+        """Returns the library-wide per-column count, min, max, mean and std of the raw features (None if empty)."""
+        if not self.entries:
+            return None
+        entries = list(self.entries.values())
+        count = sum(entry['chunks'] for entry in entries)
+        total = np.sum([entry['sum'] for entry in entries], axis=0)
+        total_sq = np.sum([entry['sum_sq'] for entry in entries], axis=0)
+        mean = total / count
+        return {
+            'count': count,
+            'min': np.min([entry['min'] for entry in entries], axis=0),
+            'max': np.max([entry['max'] for entry in entries], axis=0),
+            'mean': mean,
+            'std': np.sqrt(np.maximum(total_sq / count - mean ** 2, 0.0)),
         }
 
-def concatenate_with_crossfade(chunks, fade_duration_s, sample_rate):
-    """Concatenates a list of audio chunks with a linear crossfade."""
-    if not chunks:
+    def feature_ranges(self):
+        """The library's (min, max) per column, for normalize_features."""
+        stats = self.stats()
+        return None if stats is None else (stats['min'].astype(np.float32), stats['max'].astype(np.float32))
+
+    def _table(self, entry):
+        table = self._tables.get(entry['key'])
+        if table is None:
+            with np.load(self._shard_path(entry['key'])) as shard:
+                starts, lengths, features = shard['starts'], shard['lengths'], shard['features']
+            audio_path = os.path.join(self.library_dir, entry['audio'])
+            table = ChunkTable(self.settings['sr'], [audio_path], np.zeros(len(starts)), starts, lengths, features)
+            self._tables[entry['key']] = table
+        return table
+
+    def pool(self):
+        """Returns all chunks of the library as one ChunkTable of raw features, in manifest order."""
+        return ChunkTable.concat([self._table(entry) for entry in self.entries.values()], self.settings['sr'])
+
+    def normalize(self, tables):
+        """Normalizes tables (the pool and a reference) with the library's range."""
+        normalize_features(tables, ranges=self.feature_ranges())
+
+def make_matcher(source_pool, feature_weights, use_duration_match, mfcc_distance_metric, index='auto', approx_candidates=0,
+                 quantize=None):
+    """
+    Returns the matcher for a normalized source pool: a SourceIndex if index is
+    'kdtree', or 'auto', the metric is Euclidean and the pool has at least
+    INDEX_AUTO_MIN_CHUNKS chunks, and a SourceMatcher otherwise.
+
+    If quantize (QuantizedMatcher keyword arguments, including the mode) is
+    given, a QuantizedMatcher is returned instead.
+    """
+    if quantize is not None:
+        return QuantizedMatcher(source_pool, feature_weights, use_duration_match, mfcc_distance_metric, **quantize)
+    use_index = index == 'kdtree' or (index == 'auto' and mfcc_distance_metric == 'euclidean'
+                                      and len(source_pool) >= INDEX_AUTO_MIN_CHUNKS)
+    if not use_index:
+        return SourceMatcher(source_pool, feature_weights, use_duration_match, mfcc_distance_metric)
+    return SourceIndex(source_pool, approx_candidates=approx_candidates).configure(feature_weights, use_duration_match,
+                                                                                mfcc_distance_metric)
+
+def load_source_pool(sources, chunk_duration_min_s, chunk_duration_max_s, sample_rate, library=None, cache=None, rng=None,
+                     jobs=1, split_s=DEFAULT_SPLIT_SECONDS, store=None, extractor=DEFAULT_EXTRACTOR):
+    """
+    Analyzes the sources, or adds them to a CorpusLibrary and loads all of it,
+    and returns (source_pool, ranges): the pool normalized with its own
+    feature range, and that range.
+
+    This is for modes where the references are not known up front (the server
+    and live mode): references are then normalized with the same range.
+    """
+    if library is not None:
+        if sources:
+            library.add(sources, cache=cache, rng=rng, jobs=jobs, split_s=split_s)
+        source_pool = library.pool()
+        ranges = library.feature_ranges()
+    else:
+        tables = analyze_files(sources, chunk_duration_min_s, chunk_duration_max_s, sample_rate, cache=cache, rng=rng,
+                               jobs=jobs, split_s=split_s, store=store, extractor=extractor)
+        source_pool = ChunkTable.concat(tables, sample_rate)
+        ranges = feature_ranges([source_pool])
+    if len(source_pool):
+        normalize_features([source_pool], ranges=ranges)
+    return source_pool, ranges
+
+# --- Parallel Matching ---
+
+class SharedArray:
+    """
+    A copy of a numpy array in a shared memory block, which other processes
+    attach to by its spec instead of receiving a pickled copy.
+    """
+    def __init__(self, array, order='C'):
+        array = np.asarray(array)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        self.spec = (self.shm.name, array.shape, array.dtype.str, order)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf, order=order)[...] = array
+
+    @staticmethod
+    def attach(spec):
+        """Returns (shared memory block, array view) for a spec; keep the block referenced while using the view."""
+        name, shape, dtype, order = spec
+        shm = shared_memory.SharedMemory(name=name)
+        return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf, order=order)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+# The matcher of a matching worker process, set up by _init_match_worker.
+_match_worker = None
+
+def _init_match_worker(norm_spec, mfccs_spec, sample_rate, feature_weights, use_duration_match, mfcc_distance_metric):
+    global _match_worker
+    norm_shm, norm = SharedArray.attach(norm_spec)
+    mfccs_shm, mfccs = SharedArray.attach(mfccs_spec)
+    # A features-only pool: the shared matrix is used as is, and the unused
+    # row metadata is never written, so it takes no memory
+    n = len(norm)
+    pool = ChunkTable(sample_rate, [], np.zeros(n, dtype=np.int32), np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64), norm)
+    pool.norm = norm
+    matcher = SourceMatcher(pool, feature_weights, use_duration_match, mfcc_distance_metric, mfccs=mfccs)
+    _match_worker = (norm_shm, mfccs_shm, matcher)
+
+def _match_worker_rows(reference_features):
+    return _match_worker[2].best_matches(reference_features)
+
+class ParallelMatcher:
+    """
+    Splits the reference chunks of every best_matches() call across worker
+    processes, each scanning the whole source pool with a SourceMatcher.
+
+    The normalized source features (and the row-major MFCC copy the matcher
+    scores against) are published once in shared memory; workers attach to
+    them when they start, so the pool is neither pickled nor copied per
+    worker. Results are gathered in the order of the reference chunks, so
+    they are the same as those of the wrapped matcher.
+
+    Shared memory and workers are released by close(), at the latest when the
+    interpreter exits.
+    """
+    def __init__(self, matcher, workers):
+        if not isinstance(matcher, SourceMatcher):
+            raise ValueError("Parallel matching needs a SourceMatcher (the vectorized scan).")
+        self.matcher = matcher
+        self.workers = workers
+        self._norm = SharedArray(matcher.source_pool.norm, order='F')
+        self._mfccs = SharedArray(matcher.mfccs)
+        weights = {'rms': matcher.w_rms, 'pitch': matcher.w_pitch, 'mfcc': matcher.w_mfcc, 'duration': matcher.w_duration}
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_match_worker,
+                                             initargs=(self._norm.spec, self._mfccs.spec, matcher.source_pool.sr, weights,
+                                                       matcher.use_duration_match, matcher.mfcc_distance_metric))
+        self._finalizer = weakref.finalize(self, ParallelMatcher._release, self._executor, [self._norm, self._mfccs])
+
+    @staticmethod
+    def _release(executor, shared):
+        executor.shutdown()
+        for array in shared:
+            array.close()
+
+    def __len__(self):
+        return len(self.matcher)
+
+    def best_matches(self, reference_features, progress=False):
+        """
+        Returns the row of the best matching source chunk for each row of
+        normalized reference features, in order (-1 if the pool is empty).
+        """
+        reference_features = np.asarray(reference_features)
+        if not len(self) or len(reference_features) < 2:
+            return self.matcher.best_matches(reference_features, progress)
+        parts = np.array_split(reference_features, min(self.workers, len(reference_features)))
+        futures = [self._executor.submit(_match_worker_rows, part) for part in parts]
+        return np.concatenate([future.result() for future in futures])
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# --- Quantized Features ---
+
+QUANTIZE_MODES = ('float16', 'sq8', 'pq')
+
+# Candidates per reference chunk that a QuantizedMatcher re-ranks exactly.
+DEFAULT_RERANK = 32
+# Number of column groups the MFCCs are split into by product quantization.
+DEFAULT_PQ_SUBSPACES = 4
+# Rows sampled from the pool to train the product quantization codebooks.
+PQ_TRAIN_ROWS = 16384
+
+class QuantizedFeatures:
+    """
+    Compressed copy of a normalized feature matrix, for scanning large pools.
+
+    - 'float16': the features at half precision (2 bytes per value).
+    - 'sq8': scalar quantization. Every column is one byte per row, the index
+      of one of 256 evenly spaced levels between the column's min and max.
+    - 'pq': product quantization. RMS, pitch and duration as in 'sq8'; the
+      MFCCs are split into pq_subspaces groups of columns, and each group is
+      one byte per row, the index of its nearest centroid in a codebook of
+      256 learned with k-means.
+
+    For 'sq8' and 'pq', `codes` holds one uint8 per subspace (a group of
+    columns) and row, and `codebooks` the (levels, columns) centroids of each
+    subspace, so distances can be computed from per-subspace lookup tables.
+    """
+    def __init__(self, norm, mode, pq_subspaces=DEFAULT_PQ_SUBSPACES, seed=0):
+        if mode not in QUANTIZE_MODES:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        norm = np.asarray(norm, dtype=np.float32)
+        self.mode = mode
+        self.n_rows = len(norm)
+        self.values = None
+        self.subspaces, self.codebooks = [], []
+        if mode == 'float16':
+            self.values = np.ascontiguousarray(norm, dtype=np.float16)
+            return
+
+        mfcc_columns = np.arange(MFCC_COLUMNS.start, MFCC_COLUMNS.stop)
+        if mode == 'sq8':
+            mfcc_groups = [[column] for column in mfcc_columns]
+        else:
+            mfcc_groups = [list(group) for group in np.array_split(mfcc_columns, max(1, min(pq_subspaces, N_MFCC)))]
+        rng = np.random.default_rng(seed)
+        codes = []
+        for columns in [[RMS_COLUMN], [PITCH_COLUMN]] + mfcc_groups + [[DURATION_COLUMN]]:
+            data = norm[:, columns]
+            if len(columns) == 1:
+                codebook, code = self._scalar_quantize(data[:, 0])
+            else:
+                codebook, code = self._train_codebook(data, rng)
+            self.subspaces.append(columns)
+            self.codebooks.append(codebook)
+            codes.append(code)
+        self.codes = np.ascontiguousarray(np.stack(codes, axis=1)) if codes else np.zeros((0, 0), dtype=np.uint8)
+
+    @staticmethod
+    def _scalar_quantize(values):
+        low = float(values.min()) if len(values) else 0.0
+        high = float(values.max()) if len(values) else 0.0
+        step = (high - low) / 255 or 1.0
+        codebook = (low + step * np.arange(256, dtype=np.float32))[:, None]
+        code = np.clip(np.round((values - low) / step), 0, 255).astype(np.uint8)
+        return codebook.astype(np.float32), code
+
+    @staticmethod
+    def _train_codebook(data, rng):
+        train = data if len(data) <= PQ_TRAIN_ROWS else data[rng.choice(len(data), PQ_TRAIN_ROWS, replace=False)]
+        k = min(256, len(train))
+        with warnings.catch_warnings():
+            # Empty clusters are harmless here: they are simply never used
+            warnings.simplefilter('ignore')
+            codebook, _ = kmeans2(train.astype(np.float64), k, minit='++', seed=int(rng.integers(2 ** 31)))
+        code, _ = vq(data.astype(np.float64), codebook)
+        return codebook.astype(np.float32), code.astype(np.uint8)
+
+    @property
+    def nbytes(self):
+        if self.values is not None:
+            return self.values.nbytes
+        return self.codes.nbytes + sum(codebook.nbytes for codebook in self.codebooks)
+
+    def decode(self, rows=slice(None)):
+        """Returns the approximate float32 features of the given rows."""
+        if self.values is not None:
+            return self.values[rows].astype(np.float32)
+        codes = self.codes[rows]
+        decoded = np.empty((len(codes), N_FEATURES), dtype=np.float32)
+        for s, (columns, codebook) in enumerate(zip(self.subspaces, self.codebooks)):
+            decoded[:, columns] = codebook[codes[:, s]]
+        return decoded
+
+class QuantizedMatcher:
+    """
+    Matcher that scans a QuantizedFeatures copy of the source pool instead of
+    the float32 features, and re-ranks the `rerank` best candidates of each
+    reference chunk with the exact distances of SourceMatcher.
+
+    With 'sq8' and 'pq', the approximate distances are computed on the codes
+    directly: for each reference chunk and subspace, the distance to each of
+    the 256 centroids is computed once, and a source chunk's distance is then
+    a sum of table lookups. With 'float16', blocks of the pool are upcast and
+    scored as usual. The result equals SourceMatcher whenever the true best
+    match is among the candidates; see quantization_report for the recall.
+
+    The codes only depend on the pool's normalized features, so matchers for
+    other weights or metrics can share them: pass an existing
+    QuantizedFeatures as `quantized` (mode, pq_subspaces and seed are then
+    ignored).
+    """
+    # Upper bound (in bytes) for the approximate distances of a block of reference chunks.
+    BLOCK_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, source_pool, feature_weights, use_duration_match, mfcc_distance_metric, mode='sq8',
+                 rerank=DEFAULT_RERANK, pq_subspaces=DEFAULT_PQ_SUBSPACES, seed=0, quantized=None):
+        self.exact = SourceMatcher(source_pool, feature_weights, use_duration_match, mfcc_distance_metric)
+        self.source_pool = source_pool
+        self.rerank = max(1, rerank)
+        if quantized is None:
+            quantized = QuantizedFeatures(source_pool.norm, mode, pq_subspaces=pq_subspaces, seed=seed)
+        self.quantized = quantized
+        self.mfcc_norms = None
+        if mfcc_distance_metric == 'cosine' and self.quantized.values is None:
+            # Norms of the decoded MFCCs, so cosine similarities can be built from dot product tables
+            self.mfcc_norms = np.linalg.norm(self.quantized.decode()[:, MFCC_COLUMNS], axis=1).astype(np.float32)
+
+    def __len__(self):
+        return len(self.source_pool)
+
+    @property
+    def nbytes(self):
+        """Memory scanned per query: the compressed features, plus the decoded MFCC norms for cosine."""
+        return self.quantized.nbytes + (self.mfcc_norms.nbytes if self.mfcc_norms is not None else 0)
+
+    def _code_distances(self, reference_features):
+        """Approximate distances from the codes, using one lookup table per subspace."""
+        m, q = self.exact, self.quantized
+        scalar_weights = {RMS_COLUMN: m.w_rms, PITCH_COLUMN: m.w_pitch,
+                          DURATION_COLUMN: m.w_duration if m.use_duration_match else 0.0}
+        total = np.zeros((len(reference_features), len(self)), dtype=np.float32)
+        mfcc_total = np.zeros_like(total)
+        for s, (columns, codebook) in enumerate(zip(q.subspaces, q.codebooks)):
+            ref = reference_features[:, columns]
+            if columns[0] in scalar_weights:
+                if scalar_weights[columns[0]]:
+                    table = scalar_weights[columns[0]] * np.abs(ref - codebook[:, 0])
+                    total += table[:, q.codes[:, s]]
+            elif m.mfcc_distance_metric == 'euclidean':
+                table = ((ref[:, None, :] - codebook[None, :, :]) ** 2).sum(axis=2)
+                mfcc_total += table[:, q.codes[:, s]]
+            else:
+                mfcc_total += (ref @ codebook.T)[:, q.codes[:, s]]
+        if m.w_mfcc:
+            if m.mfcc_distance_metric == 'euclidean':
+                total += m.w_mfcc * np.sqrt(mfcc_total)
+            else:
+                norm_prod = np.linalg.norm(reference_features[:, MFCC_COLUMNS], axis=1)[:, None] * self.mfcc_norms
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    total += m.w_mfcc * np.where(norm_prod == 0, 1.0, 1 - mfcc_total / norm_prod)
+        return total
+
+    def _float16_distances(self, reference_features):
+        """Approximate distances from the half-precision features, upcast one block of the pool at a time."""
+        m = self.exact
+        block_rows = max(1, self.BLOCK_BYTES // (N_FEATURES * 4))
+        total = np.empty((len(reference_features), len(self)), dtype=np.float32)
+        for start in range(0, len(self), block_rows):
+            decoded = self.quantized.decode(slice(start, start + block_rows))
+            zeros = np.zeros(len(decoded))
+            block = ChunkTable(self.source_pool.sr, [], zeros, zeros, zeros, decoded)
+            block.norm = decoded
+            scorer = SourceMatcher(block, {'rms': m.w_rms, 'pitch': m.w_pitch, 'mfcc': m.w_mfcc, 'duration': m.w_duration},
+                                   m.use_duration_match, m.mfcc_distance_metric)
+            total[:, start:start + len(decoded)] = scorer.distances(reference_features)
+        return total
+
+    def best_matches(self, reference_features, progress=False):
+        """
+        Returns the row of the best matching source chunk for each row of
+        normalized reference features, in order (-1 if the pool is empty).
+        """
+        reference_features = np.asarray(reference_features, dtype=np.float32)
+        if not len(self):
+            return np.full(len(reference_features), -1, dtype=np.int64)
+        if self.rerank >= len(self):
+            return self.exact.best_matches(reference_features, progress)
+
+        block_size = max(1, self.BLOCK_BYTES // (4 * len(self)))
+        matches = np.empty(len(reference_features), dtype=np.int64)
+        with tqdm(total=len(reference_features), desc="Finding best matches", disable=not progress) as pbar:
+            for block_start in range(0, len(reference_features), block_size):
+                block = reference_features[block_start:block_start + block_size]
+                if self.quantized.values is not None:
+                    approx = self._float16_distances(block)
+                else:
+                    approx = self._code_distances(block)
+                candidates = np.sort(np.argpartition(approx, self.rerank - 1, axis=1)[:, :self.rerank], axis=1)
+                for i, rows in enumerate(candidates):
+                    # Rows are sorted, so ties resolve to the earliest candidate.
+                    matches[block_start + i] = rows[np.argmin(self.exact.distances(block[i:i + 1], rows)[0])]
+                pbar.update(len(block))
+        return matches
+
+def quantization_report(matcher, reference_features):
+    """
+    Compares a QuantizedMatcher with exact matching on the given reference
+    chunks: memory of the scanned features (float32 vs compressed) and recall,
+    the share of reference chunks whose match is as close as the exact best
+    one.
+    """
+    reference_features = np.asarray(reference_features, dtype=np.float32)
+    exact = matcher.exact.best_matches(reference_features)
+    approx = matcher.best_matches(reference_features)
+    rows = np.arange(len(reference_features))
+    exact_distances = np.array([matcher.exact.distances(reference_features[i:i + 1], [exact[i]])[0, 0] for i in rows])
+    approx_distances = np.array([matcher.exact.distances(reference_features[i:i + 1], [approx[i]])[0, 0] for i in rows])
+    exact_bytes = len(matcher) * N_FEATURES * np.dtype(np.float32).itemsize
+    return {
+        'mode': matcher.quantized.mode,
+        'rerank': matcher.rerank,
+        'exact_bytes': int(exact_bytes),
+        'compressed_bytes': int(matcher.nbytes),
+        'compression': round(exact_bytes / max(1, matcher.nbytes), 3),
+        'recall': round(float(np.mean(approx_distances <= exact_distances + 1e-6)), 6) if len(rows) else 1.0,
+        'same_match': round(float(np.mean(approx == exact)), 6) if len(rows) else 1.0,
+    }
+
+# --- Pitch Adjustment ---
+
+def pitch_shift(audio, sr, n_steps):
+    """Pitch-shifts audio by n_steps semitones. Module-level so worker processes can run it."""
+    return librosa.effects.pitch_shift(y=np.asarray(audio), sr=sr, n_steps=n_steps)
+
+class PitchShiftCache:
+    """
+    Bounded LRU cache of pitch-shifted source chunks.
+
+    Entries are keyed by (source row, semitone offset rounded to `quantum`),
+    so a popular source chunk that is shifted by (nearly) the same amount for
+    several reference chunks is only shifted once. Only the shifted audio is
+    stored, never a copy of the chunk's features.
+
+    If an executor is given, misses are submitted to it and request() returns
+    a Future, so the shifting runs while the main process keeps matching.
+    Entries are evicted, least recently used first, once the cached audio
+    exceeds max_bytes.
+    """
+    def __init__(self, source_pool, max_bytes=256 * 1024 * 1024, quantum=0.05, executor=None):
+        self.source_pool = source_pool
+        self.max_bytes = max_bytes
+        self.quantum = quantum
+        self.executor = executor
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def _key(self, src_row, n_semitones):
+        if self.quantum:
+            return (int(src_row), int(round(n_semitones / self.quantum)))
+        return (int(src_row), float(n_semitones))
+
+    def request(self, src_row, n_semitones):
+        """Returns the shifted audio of a source chunk, or a Future for it."""
+        key = self._key(src_row, n_semitones)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+        self.misses += 1
+        audio = self.source_pool.audio(src_row)
+        n_steps = key[1] * self.quantum if self.quantum else key[1]
+        if self.executor is not None:
+            shifted = self.executor.submit(pitch_shift, np.asarray(audio), self.source_pool.sr, n_steps)
+        else:
+            shifted = pitch_shift(audio, self.source_pool.sr, n_steps)
+
+        # pitch_shift keeps the length, so the size is known before it finishes
+        nbytes = len(audio) * np.dtype(np.float32).itemsize
+        self._entries[key] = (shifted, nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self._bytes -= evicted_bytes
+        return shifted
+
+# Reference chunks matched per block by render_segments. Pitch shifts for a
+# block are submitted before the next block is matched.
+MATCH_BLOCK_SIZE = 256
+
+def render_segments(reference_chunks, source_pool, matcher, pitch_cache=None, progress=False):
+    """
+    Matches every reference chunk and returns the audio segments of the output,
+    in order.
+
+    If a PitchShiftCache is given, each source chunk is shifted to the pitch of
+    its reference chunk. Matching runs in blocks, and the shifts of a block are
+    requested before the next block is matched, so a cache with an executor
+    shifts while matching continues.
+    """
+    segments = []
+    with tqdm(total=len(reference_chunks), desc="Finding best matches", disable=not progress) as pbar:
+        for block_start in range(0, len(reference_chunks), MATCH_BLOCK_SIZE):
+            block_matches = matcher.best_matches(reference_chunks.norm[block_start:block_start + MATCH_BLOCK_SIZE])
+            for ref_row, src_row in enumerate(block_matches, start=block_start):
+                if src_row < 0:
+                    continue
+                # A view into the source buffer; the pool itself is never modified.
+                segment = source_pool.audio(src_row)
+
+                # --- Pitch Adjustment Logic (Optional) ---
+                # If enabled, this acts like an autotuner, shifting the pitch of the
+                # source chunk to match the pitch of the reference chunk.
+                if pitch_cache is not None:
+                    # Get the original, non-normalized pitches in Hz
+                    ref_pitch_hz = reference_chunks.pitch[ref_row]
+                    src_pitch_hz = source_pool.pitch[src_row]
+
+                    # Only attempt to shift if both pitches were detected and are valid
+                    if ref_pitch_hz > 0 and src_pitch_hz > 0:
+                        # Calculate the pitch difference in semitones
+                        n_semitones = 12 * np.log2(ref_pitch_hz / src_pitch_hz)
+                        segment = pitch_cache.request(src_row, n_semitones)
+
+                segments.append(segment)
+            pbar.update(len(block_matches))
+
+    return [segment.result() if isinstance(segment, Future) else segment for segment in segments]
+
+@functools.lru_cache(maxsize=64)
+def fade_ramps(overlap_len):
+    """Returns read-only (fade_out, fade_in) linear ramps, cached per overlap length."""
+    fade_out = np.linspace(1, 0, overlap_len)
+    fade_in = np.linspace(0, 1, overlap_len)
+    fade_out.flags.writeable = False
+    fade_in.flags.writeable = False
+    return fade_out, fade_in
+
+def concatenate_with_crossfade(segments, fade_duration_s, sample_rate):
+    """
+    Concatenates a list of audio segments (1-D arrays) with a linear crossfade.
+
+    Each segment overlaps the end of the output so far by up to the fade
+    duration. The final length is computed first, and every segment is then
+    overlap-added into one preallocated buffer, so the cost is linear in the
+    output length.
+    """
+    if not segments:
         return np.array([])
-    if len(chunks) == 1:
-        return chunks[0].audio
+    if len(segments) == 1:
+        return segments[0]
 
     print("Concatenating chunks with crossfade...")
     fade_samples = int(fade_duration_s * sample_rate)
-    
+
+    # First pass: the overlap with the output so far, for each segment
+    overlaps = [0]
+    output_len = len(segments[0])
+    for segment in segments[1:]:
+        overlap_len = min(fade_samples, output_len, len(segment))
+        overlaps.append(overlap_len)
+        output_len += len(segment) - overlap_len
+
+    # Crossfaded samples are computed in float64 (the dtype of the ramps)
+    dtypes = [segment.dtype for segment in segments] + ([np.float64] if any(overlaps) else [])
+    output = np.empty(output_len, dtype=np.result_type(*dtypes))
+
     # Start with the first chunk's audio
-    output = chunks[0].audio.copy()
-    
-    for i in tqdm(range(1, len(chunks)), desc="Crossfading"):
-        next_chunk_audio = chunks[i].audio
-        
-        # Determine overlap size
-        overlap_len = min(fade_samples, len(output), len(next_chunk_audio))
-        
-        if overlap_len == 0:
-            output = np.concatenate((output, next_chunk_audio))
-            continue
-            
-        # Create fade ramps
-        fade_out = np.linspace(1, 0, overlap_len)
-        fade_in = np.linspace(0, 1, overlap_len)
-        
-        # The crossfaded section
-        crossfaded_section = (output[-overlap_len:] * fade_out) + (next_chunk_audio[:overlap_len] * fade_in)
-        
-        # Concatenate all parts
-        output = np.concatenate((output[:-overlap_len], crossfaded_section, next_chunk_audio[overlap_len:]))
-        
+    pos = len(segments[0])
+    output[:pos] = segments[0]
+
+    for segment, overlap_len in tqdm(zip(segments[1:], overlaps[1:]), total=len(segments) - 1, desc="Crossfading"):
+        if overlap_len:
+            fade_out, fade_in = fade_ramps(overlap_len)
+            # The crossfaded section, mixed in place at the end of the output
+            crossfaded_section = output[pos - overlap_len:pos]
+            crossfaded_section *= fade_out
+            crossfaded_section += segment[:overlap_len] * fade_in
+
+        # The rest of the segment follows the crossfaded section
+        output[pos:pos + len(segment) - overlap_len] = segment[overlap_len:]
+        pos += len(segment) - overlap_len
+
     return output
 
+# Reference chunks matched and written per block in streaming mode.
+STREAM_BLOCK_SIZE = 2048
+
+class StreamingCrossfader:
+    """
+    Writes segments with a linear crossfade to an open soundfile.SoundFile as
+    they arrive.
+
+    The samples written are the same as concatenate_with_crossfade would
+    return for all of the segments, but only the last fade duration of the
+    output is kept in memory, since that is all the next segment can overlap.
+    A fade duration of 0 simply concatenates.
+    """
+    def __init__(self, out_file, fade_duration_s, sample_rate):
+        self.out_file = out_file
+        self.fade_samples = int(fade_duration_s * sample_rate)
+        self.tail = None
+        self.segments = 0
+        self.samples = 0
+
+    def write(self, segment):
+        segment = np.asarray(segment)
+        self.segments += 1
+        if self.tail is None:
+            pending = segment
+        else:
+            overlap_len = min(self.fade_samples, len(self.tail), len(segment))
+            if overlap_len:
+                fade_out, fade_in = fade_ramps(overlap_len)
+                crossfaded_section = self.tail[len(self.tail) - overlap_len:] * fade_out + segment[:overlap_len] * fade_in
+                pending = np.concatenate([self.tail[:len(self.tail) - overlap_len], crossfaded_section, segment[overlap_len:]])
+            else:
+                pending = np.concatenate([self.tail, segment])
+
+        # Everything but the part the next segment may overlap is final
+        keep = min(self.fade_samples, len(pending))
+        self._flush(pending[:len(pending) - keep])
+        self.tail = pending[len(pending) - keep:]
+
+    def _flush(self, samples):
+        if len(samples):
+            self.out_file.write(samples)
+            self.samples += len(samples)
+
+    def close(self):
+        """Writes the samples still held back for the next crossfade."""
+        if self.tail is not None:
+            self._flush(self.tail)
+            self.tail = None
+
+def stream_segments(reference_chunks, source_pool, matcher, out_file, fade_duration_s, sample_rate, pitch_cache=None,
+                    progress=True):
+    """
+    Streaming counterpart of render_segments plus concatenate_with_crossfade:
+    reference chunks are matched in blocks of STREAM_BLOCK_SIZE and each
+    block's segments are crossfaded straight into out_file (an open
+    soundfile.SoundFile, or anything else with a write(samples) method).
+    Returns the StreamingCrossfader, for its segment and sample counts.
+    """
+    writer = StreamingCrossfader(out_file, fade_duration_s, sample_rate)
+    for block_start in tqdm(range(0, len(reference_chunks), STREAM_BLOCK_SIZE), desc="Streaming output", disable=not progress):
+        block = reference_chunks.rows(block_start, block_start + STREAM_BLOCK_SIZE)
+        for segment in render_segments(block, source_pool, matcher, pitch_cache):
+            writer.write(segment)
+    writer.close()
+    return writer
+
+# --- Batch Mode ---
+
+def read_manifest(path):
+    """
+    Reads a batch manifest: one reference per line, optionally followed by a
+    comma and its output path (CSV quoting applies). Blank lines and lines
+    starting with '#' are skipped. Returns a list of (reference, output or None).
+    """
+    jobs = []
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].lstrip().startswith('#'):
+                continue
+            output = row[1].strip() if len(row) > 1 and row[1].strip() else None
+            jobs.append((row[0].strip(), output))
+    return jobs
+
+def batch_output_paths(jobs, output_dir):
+    """
+    Returns the output path of each (reference, output) job: the given output,
+    or <output_dir>/<reference name>.wav. Repeated names get a numeric suffix.
+    """
+    paths, used = [], set()
+    for reference, output in jobs:
+        if output is None:
+            if output_dir is None:
+                raise ValueError(f"No output given for {reference}; use --output-dir.")
+            stem = os.path.splitext(os.path.basename(reference))[0]
+            output, n = os.path.join(output_dir, stem + '.wav'), 1
+            while output in used:
+                n += 1
+                output = os.path.join(output_dir, f"{stem}_{n}.wav")
+        used.add(output)
+        paths.append(output)
+    return paths
+
+def render_batch(reference_tables, output_paths, source_pool, matcher, fade_duration_s, sample_rate, workers=1,
+                 pitch_options=None, executor=None):
+    """
+    Renders each reference table into its output file against one shared
+    source pool and matcher, one after another or on `workers` threads (the
+    matchers are read-only once configured, and the array work releases the
+    GIL). Output is written as it is synthesized, see stream_segments.
+
+    If pitch_options (PitchShiftCache keyword arguments) are given, every
+    reference gets a pitch shift cache of its own, shifting on the shared
+    executor. Returns one (output_path, StreamingCrossfader or exception) per
+    reference, in order.
+    """
+    def render(reference_chunks, output_path):
+        try:
+            pitch_cache = None
+            if pitch_options is not None:
+                pitch_cache = PitchShiftCache(source_pool, executor=executor, **pitch_options)
+            with sf.SoundFile(output_path, 'w', samplerate=sample_rate, channels=1) as out_file:
+                return stream_segments(reference_chunks, source_pool, matcher, out_file, fade_duration_s, sample_rate,
+                                       pitch_cache, progress=False)
+        except Exception as e:
+            return e
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(render, table, path) for table, path in zip(reference_tables, output_paths)]
+        for path, future in tqdm(zip(output_paths, futures), total=len(futures), desc="Rendering references"):
+            results.append((path, future.result()))
+    return results
+
+# --- Sweep Mode ---
+
+# Columns of the sweep summary table, after the configuration itself.
+SWEEP_STAT_COLUMNS = ['unique_sources', 'max_reuse', 'source_files', 'rms_error', 'pitch_error_st', 'mfcc_distance',
+                      'duration_error_s', 'seconds']
+
+def sweep_configs(weight_grid, metrics):
+    """
+    Returns every (feature_weights, mfcc_distance_metric) combination of a
+    sweep, where weight_grid maps each weight name to the values to try.
+    """
+    names = list(weight_grid)
+    return [(dict(zip(names, values)), metric)
+            for values in itertools.product(*(weight_grid[name] for name in names)) for metric in metrics]
+
+def sweep_output_path(output_dir, reference, feature_weights, metric):
+    """Output path of one sweep configuration, e.g. ref_rms1_pitch1.5_mfcc1_duration0.5_euclidean.wav."""
+    stem = os.path.splitext(os.path.basename(reference))[0]
+    weights = '_'.join(f"{name}{value:g}" for name, value in feature_weights.items())
+    return os.path.join(output_dir, f"{stem}_{weights}_{metric}.wav")
+
+class MatchRecorder:
+    """Wraps a matcher and keeps the matches it returns, in order, for match_statistics."""
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.matches = []
+
+    def best_matches(self, reference_features):
+        matches = self.matcher.best_matches(reference_features)
+        self.matches.append(matches)
+        return matches
+
+def match_statistics(reference_chunks, source_pool, matches):
+    """
+    Summarizes a set of matches: how many distinct source chunks (and files)
+    were used and how often the most used chunk repeats, and the mean error
+    per feature between each reference chunk and its match (normalized RMS,
+    pitch in semitones over chunks voiced in both, normalized euclidean MFCC
+    distance whatever the matching metric, and duration in seconds).
+    """
+    matches = np.asarray(matches)
+    ref, src = reference_chunks, source_pool
+    ref_pitch, src_pitch = ref.pitch, src.pitch[matches]
+    voiced = (ref_pitch > 0) & (src_pitch > 0)
+    return {
+        'unique_sources': len(np.unique(matches)),
+        'max_reuse': int(np.bincount(matches).max()),
+        'source_files': len(np.unique(src.file_ids[matches])),
+        'rms_error': round(float(np.abs(ref.norm[:, RMS_COLUMN] - src.norm[matches, RMS_COLUMN]).mean()), 6),
+        'pitch_error_st': round(float(np.abs(12 * np.log2(ref_pitch[voiced] / src_pitch[voiced])).mean()), 6) if voiced.any() else '',
+        'mfcc_distance': round(float(np.linalg.norm(ref.norm[:, MFCC_COLUMNS] - src.norm[matches][:, MFCC_COLUMNS], axis=1).mean()), 6),
+        'duration_error_s': round(float(np.abs(ref.duration - src.duration[matches]).mean()) / src.sr, 6),
+    }
+
+def render_sweep(reference_chunks, source_pool, configs, output_paths, use_duration_match, fade_duration_s, sample_rate,
+                 index='auto', approx_candidates=0, quantize=None, workers=1, pitch_options=None, executor=None):
+    """
+    Renders one reference once per (feature_weights, metric) configuration,
+    each into its own output file, on `workers` threads. The reference and
+    the pool are analyzed and normalized once and shared read-only; every
+    configuration builds its own matcher (a KD-tree depends on the weights),
+    but with quantize the compressed features are built once and shared.
+
+    Returns one (output_path, statistics or exception) per configuration, in
+    order; the statistics are those of match_statistics plus the seconds the
+    configuration took.
+    """
+    if quantize is not None:
+        # The codebooks (and PQ's k-means) only depend on the normalized pool
+        quantize = dict(quantize, quantized=QuantizedFeatures(source_pool.norm, quantize['mode'],
+                                                              pq_subspaces=quantize.get('pq_subspaces', DEFAULT_PQ_SUBSPACES),
+                                                              seed=quantize.get('seed', 0)))
+
+    def render(config, output_path):
+        try:
+            start = time.perf_counter()
+            feature_weights, metric = config
+            matcher = MatchRecorder(make_matcher(source_pool, feature_weights, use_duration_match, metric, index=index,
+                                                 approx_candidates=approx_candidates, quantize=quantize))
+            pitch_cache = None
+            if pitch_options is not None:
+                pitch_cache = PitchShiftCache(source_pool, executor=executor, **pitch_options)
+            with sf.SoundFile(output_path, 'w', samplerate=sample_rate, channels=1) as out_file:
+                stream_segments(reference_chunks, source_pool, matcher, out_file, fade_duration_s, sample_rate, pitch_cache,
+                                progress=False)
+            stats = match_statistics(reference_chunks, source_pool, np.concatenate(matcher.matches))
+            stats['seconds'] = round(time.perf_counter() - start, 6)
+            return stats
+        except Exception as e:
+            return e
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(render, config, path) for config, path in zip(configs, output_paths)]
+        for path, future in tqdm(zip(output_paths, futures), total=len(futures), desc="Rendering configurations"):
+            results.append((path, future.result()))
+    return results
+
+def write_sweep_summary(path, configs, results):
+    """Writes one CSV row per rendered configuration: its weights, metric, output and match statistics."""
+    weight_names = list(configs[0][0]) if configs else []
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([f"weight_{name}" for name in weight_names] + ['metric', 'output'] + SWEEP_STAT_COLUMNS)
+        for (feature_weights, metric), (output, stats) in zip(configs, results):
+            if isinstance(stats, Exception):
+                continue
+            writer.writerow([feature_weights[name] for name in weight_names] + [metric, output] +
+                            [stats[column] for column in SWEEP_STAT_COLUMNS])
+
+# --- Live Mode ---
+
+# Sample formats accepted (and emitted) on raw PCM streams, as numpy dtypes.
+PCM_FORMATS = {'s16': np.dtype('<i2'), 'f32': np.dtype('<f4')}
+
+# Audio kept from previous blocks, so frames at the start of a block see the
+# preceding audio instead of padding. A multiple of HOP_LENGTH.
+LIVE_CONTEXT_SAMPLES = N_FFT
+
+class RawPCMWriter:
+    """Writes mono samples to a binary stream as raw PCM in one of PCM_FORMATS."""
+    def __init__(self, stream, pcm_format):
+        self.stream = stream
+        self.dtype = PCM_FORMATS[pcm_format]
+
+    def write(self, samples):
+        samples = np.asarray(samples)
+        if self.dtype.kind == 'i':
+            samples = np.clip(np.round(samples * 32768), -32768, 32767)
+        self.stream.write(samples.astype(self.dtype).tobytes())
+        self.stream.flush()
+
+def read_pcm_blocks(stream, block_samples, pcm_format):
+    """Yields float32 blocks of block_samples samples from a raw mono PCM stream; the last one may be shorter."""
+    dtype = PCM_FORMATS[pcm_format]
+    block_bytes = block_samples * dtype.itemsize
+    while True:
+        data = b''
+        while len(data) < block_bytes:
+            more = stream.read(block_bytes - len(data))
+            if not more:
+                break
+            data += more
+        usable = len(data) // dtype.itemsize * dtype.itemsize
+        if not usable:
+            return
+        block = np.frombuffer(data[:usable], dtype=dtype).astype(np.float32)
+        yield block / 32768 if dtype.kind == 'i' else block
+        if len(data) < block_bytes:
+            return
+
+class LiveMosaic:
+    """
+    Real-time mosaicing of an audio stream, one block at a time.
+
+    Each block of the reference is cut into chunks (the last chunk takes the
+    rest of the block), analyzed together with LIVE_CONTEXT_SAMPLES of the
+    previous audio, normalized with the source pool's range and matched. Every
+    matched source chunk is cut or zero-padded to its reference chunk's length
+    plus the crossfade, so the output stays in step with the input, and the
+    result is crossfaded into out_file as soon as the block is done. The
+    frames of a block do not depend on its loudness (see _spectral_frames),
+    so apart from the last few, which cannot see the audio after the block,
+    they match an offline analysis of the stream.
+
+    The latency from the end of a block to its output is the processing time
+    of the block; on top of that, a block has to be complete before it is
+    processed, and the last crossfade duration is held back for the next
+    block. Processing times are recorded per block (see latency_report).
+    """
+    def __init__(self, source_pool, ranges, matcher, out_file, sample_rate, chunk_duration_min_s, chunk_duration_max_s,
+                 fade_duration_s, extractor=DEFAULT_EXTRACTOR, rng=None, pitch_cache=None):
+        self.source_pool = source_pool
+        self.ranges = ranges
+        self.matcher = matcher
+        self.sr = sample_rate
+        self.chunk_duration_min_s = chunk_duration_min_s
+        self.chunk_duration_max_s = chunk_duration_max_s
+        self.extractor = extractor
+        self.rng = rng
+        self.pitch_cache = pitch_cache
+        self.writer = StreamingCrossfader(out_file, fade_duration_s, sample_rate)
+        self.context = np.zeros(0, dtype=np.float32)
+        self.block_seconds = []
+        self.processing_seconds = []
+
+    def _keep_context(self, audio):
+        """Keeps the last whole hops of the audio, counted back from its end, up to LIVE_CONTEXT_SAMPLES."""
+        hops = min(len(audio), LIVE_CONTEXT_SAMPLES) // HOP_LENGTH
+        self.context = audio[len(audio) - hops * HOP_LENGTH:]
+
+    def _block_chunks(self, block):
+        boundaries = plan_chunks(len(block), self.sr, self.chunk_duration_min_s, self.chunk_duration_max_s, self.rng)
+        if boundaries:
+            boundaries[-1] = (boundaries[-1][0], len(block))
+        else:
+            boundaries = [(0, len(block))]
+        bounds = np.asarray(boundaries, dtype=np.int64)
+
+        audio = np.concatenate([self.context, block])
+        frames = FEATURE_EXTRACTORS[self.extractor].analyze(audio, self.sr)
+        # The context is whole hops (see _keep_context), so the block's first frame starts right
+        # after it and its frames line up with the chunk boundaries
+        offset = len(self.context) // HOP_LENGTH
+        frames = {name: values[..., offset:] for name, values in frames.items()}
+        self._keep_context(audio)
+
+        starts, ends = bounds[:, 0], bounds[:, 1]
+        table = ChunkTable(self.sr, [None], np.zeros(len(bounds)), starts, ends - starts, aggregate_frames(frames, starts, ends))
+        normalize_features([table], ranges=self.ranges, verbose=False)
+        return table
+
+    def process(self, block):
+        """Mosaics one block of reference samples and writes its output. Returns the processing time in seconds."""
+        start = time.perf_counter()
+        reference_chunks = self._block_chunks(block)
+        segments = render_segments(reference_chunks, self.source_pool, self.matcher, self.pitch_cache)
+        for length, segment in zip(reference_chunks.lengths, segments):
+            self.writer.write(librosa.util.fix_length(np.asarray(segment), size=int(length) + self.writer.fade_samples))
+        elapsed = time.perf_counter() - start
+        self.block_seconds.append(len(block) / self.sr)
+        self.processing_seconds.append(elapsed)
+        return elapsed
+
+    def close(self):
+        self.writer.close()
+
+    def latency_report(self):
+        """Summary of the processing time per block against the block duration."""
+        processing = np.asarray(self.processing_seconds)
+        if not len(processing):
+            return {'blocks': 0}
+        # A short last block is still due one block duration after the previous one
+        block_s = max(self.block_seconds)
+        return {
+            'blocks': len(processing),
+            'block_ms': round(1000 * block_s, 3),
+            'mean_processing_ms': round(1000 * float(processing.mean()), 3),
+            'p95_processing_ms': round(1000 * float(np.percentile(processing, 95)), 3),
+            'max_processing_ms': round(1000 * float(processing.max()), 3),
+            'max_load': round(float(processing.max() / block_s), 3),
+            'overruns': int((processing > block_s).sum()),
+            # A block's first sample waits for the rest of the block, then for processing and the held-back crossfade
+            'max_latency_ms': round(1000 * (block_s + float(processing.max()) + self.writer.fade_samples / self.sr), 3),
+        }
+
+def open_live_input(path):
+    """
+    Opens the live input: '-' for stdin, or the path of a Unix socket to listen
+    on, which accepts a single connection. Returns (binary stream, cleanup).
+    """
+    if path == '-':
+        return sys.stdin.buffer, lambda: None
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    print(f"Waiting for a PCM stream on {path}...", file=sys.stderr)
+    connection, _ = server.accept()
+    stream = connection.makefile('rb')
+
+    def cleanup():
+        stream.close()
+        connection.close()
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
+    return stream, cleanup
+
+def run_live(live, stream, block_samples, pcm_format, report=False):
+    """Feeds blocks from a PCM stream to a LiveMosaic until the stream ends, optionally reporting every block."""
+    for i, block in enumerate(read_pcm_blocks(stream, block_samples, pcm_format)):
+        elapsed = live.process(block)
+        if report:
+            block_s = len(block) / live.sr
+            print(f"Block {i}: {1000 * elapsed:.1f} ms processing for {1000 * block_s:.1f} ms of audio "
+                  f"({100 * elapsed / block_s:.0f}% load{', OVERRUN' if elapsed > block_s else ''})", file=sys.stderr)
+    live.close()
+    return live.latency_report()
+
+# --- Run Metrics ---
+
+def _peak_rss_mb(who):
+    """Peak resident memory in MB of this process or its children, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+def _children_cpu_s():
+    times = os.times()
+    return times.children_user + times.children_system
+
+class RunMetrics:
+    """
+    Per-phase timings and counters of a run, written as JSON with --metrics-out.
+
+    Each phase records its wall time, the CPU time of this process and of the
+    worker processes that finished during it, and the peak resident memory of
+    both at the end of the phase. The memory figures are high-water marks, so
+    they never decrease from one phase to the next. Counts (chunks, lookups,
+    ...) are added with count(); for the counts in RATE_COUNTS a rate per
+    second of wall time is reported as well. Other values are added with
+    record().
+
+    If profile_phase names a phase, that phase also runs under cProfile. The
+    stats are dumped to profile_out (for pstats or snakeviz), or the top
+    functions are printed if no file is given. cProfile only profiles the
+    calling thread, so work done in worker threads or processes during the
+    phase does not appear in it.
+    """
+    RATE_COUNTS = ('chunks', 'lookups')
+
+    def __init__(self, profile_phase=None, profile_out=None):
+        self.phases = OrderedDict()
+        self.profile_phase = profile_phase
+        self.profile_out = profile_out
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def _entry(self, name):
+        return self.phases.setdefault(name, {'counts': {}})
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        profiler = cProfile.Profile() if name == self.profile_phase else None
+        wall, cpu, children_cpu = time.perf_counter(), time.process_time(), _children_cpu_s()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            entry = self._entry(name)
+            entry['wall_s'] = round(time.perf_counter() - wall, 6)
+            entry['cpu_s'] = round(time.process_time() - cpu, 6)
+            entry['children_cpu_s'] = round(_children_cpu_s() - children_cpu, 6)
+            entry['peak_rss_mb'] = _peak_rss_mb(resource.RUSAGE_SELF) if resource else None
+            entry['peak_children_rss_mb'] = _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None
+            if profiler is not None:
+                self._report_profile(profiler, name)
+
+    def count(self, phase, name, value):
+        self._entry(phase)['counts'][name] = int(value)
+
+    def record(self, phase, name, value):
+        """Adds any other JSON-serializable value (e.g. a latency summary) to a phase."""
+        self._entry(phase)[name] = value
+
+    def _report_profile(self, profiler, name):
+        if self.profile_out:
+            profiler.dump_stats(self.profile_out)
+            print(f"Profile of the {name} phase written to: {self.profile_out}")
+        else:
+            print(f"\nProfile of the {name} phase:")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+    def to_dict(self):
+        phases = OrderedDict()
+        for name, entry in self.phases.items():
+            phase = dict(entry)
+            for count in self.RATE_COUNTS:
+                if count in entry['counts'] and entry.get('wall_s'):
+                    phase[f'{count}_per_s'] = round(entry['counts'][count] / entry['wall_s'], 3)
+            phases[name] = phase
+        return {
+            'wall_s': round(time.perf_counter() - self._wall, 6),
+            'cpu_s': round(time.process_time() - self._cpu, 6),
+            'children_cpu_s': round(_children_cpu_s(), 6),
+            'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+            'peak_children_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+            'phases': phases,
+        }
+
+    def write(self, path, args=None):
+        metrics = self.to_dict()
+        if args is not None:
+            metrics['args'] = vars(args)
+        with open(path, 'w') as f:
+            json.dump(metrics, f, indent=2)
+        print(f"Metrics written to: {path}")
+
 # --- Main Execution Block ---
 def main():
     parser = argparse.ArgumentParser(description="Reconstructs a reference audio file from source audio files.")
-    parser.add_argument('-r', '--reference', type=str, required=True, help="Path to the reference audio file.")
-    parser.add_argument('-s', '--sources', nargs='+', required=True, help="Paths to one or more source audio files.")
-    parser.add_argument('-o', '--output', type=str, required=True, help="Path for the output audio file.")
+    parser.add_argument('-r', '--reference', type=str, default=None, help="Path to the reference audio file.")
+    parser.add_argument('-s', '--sources', nargs='+', default=[], help="Paths to one or more source audio files. Required unless --library is given.")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Path for the output audio file.")
+    parser.add_argument('--references', nargs='+', default=None, help="Batch mode: several reference files, rendered against sources that are analyzed once. Outputs go to --output-dir.")
+    parser.add_argument('--manifest', type=str, default=None, help="Batch mode: a file listing one reference per line, optionally followed by a comma and its output path.")
+    parser.add_argument('--output-dir', type=str, default=None, help="Batch mode: directory for outputs without an explicit path, named after their reference.")
     parser.add_argument('--chunk-size-min', type=float, default=0.1, help="Minimum duration of each chunk in seconds. Default: 0.1")
     parser.add_argument('--chunk-size-max', type=float, default=0.4, help="Maximum duration of each chunk in seconds. Default: 0.4")
     parser.add_argument('--no-crossfade', dest='crossfade', action='store_false', help="Disable crossfading between chunks.")
@@ -315,11 +2403,90 @@ def main():
     parser.add_argument('--weight-duration', type=float, default=0.5, help="Weight for duration matching. Default: 0.5")
     parser.add_argument('--crossfade-duration', type=float, default=0.01, help="Duration of the crossfade in seconds. Default: 0.01")
     parser.add_argument('--no-chunk-duration-match', dest='duration_match', action='store_false', help="Disable matching based on chunk duration.")
+    parser.add_argument('--index', type=str, choices=['auto', 'kdtree', 'none'], default='auto', help="Search structure for matching. 'kdtree' queries a KD-tree over the source pool, 'none' scores every source chunk. 'auto' uses the KD-tree for pools of at least %d chunks with the Euclidean MFCC metric, and scans otherwise. Default: 'auto'." % INDEX_AUTO_MIN_CHUNKS)
+    parser.add_argument('--approx-candidates', type=int, default=0, help="Approximate KD-tree matching: only re-rank this many nearest candidates per reference chunk. Higher values improve recall at the cost of speed. Default: 0 (exact).")
+    parser.add_argument('--quantize', type=str, choices=['none'] + list(QUANTIZE_MODES), default='none', help="Match on a compressed copy of the source features and re-rank the best --rerank candidates exactly: 'float16' halves the features, 'sq8' stores one byte per feature, 'pq' also packs the MFCCs into --pq-subspaces bytes with learned codebooks. Replaces --index. Default: 'none'.")
+    parser.add_argument('--rerank', type=int, default=DEFAULT_RERANK, help="With --quantize, candidates per reference chunk re-ranked with exact distances. Default: %(default)s")
+    parser.add_argument('--pq-subspaces', type=int, default=DEFAULT_PQ_SUBSPACES, help="With --quantize pq, number of one-byte codes the MFCCs are split into. Default: %(default)s")
+    parser.add_argument('--quantize-report', action='store_true', help="With --quantize, report the memory saved and the recall against exact matching on the reference chunks.")
     parser.add_argument('--adjust-pitch', action='store_true', help="Adjust the pitch of each source chunk to match the reference chunk (autotune effect).")
+    parser.add_argument('--pitch-quantum', type=float, default=0.05, help="With --adjust-pitch, pitch offsets are rounded to multiples of this many semitones, so repeated shifts of a source chunk can be reused. 0 disables rounding. Default: 0.05")
+    parser.add_argument('--pitch-cache-mb', type=float, default=256, help="Memory limit for cached pitch-shifted chunks, in MB. Default: 256")
+    parser.add_argument('--extractor', type=str, choices=sorted(FEATURE_EXTRACTORS), default=DEFAULT_EXTRACTOR, help="Feature extractor for the analysis phase. %s. Default: '%s'." % (
+        "; ".join("'%s': %s (relative cost %.2g)" % (e.name, e.description, e.cost) for e in FEATURE_EXTRACTORS.values()), DEFAULT_EXTRACTOR))
+    parser.add_argument('--library', type=str, default=None, help="Directory of a corpus library (see mosaic_library.py) to use as the source pool. Files given with --sources are added to it first; files already in it are not analyzed again.")
+    parser.add_argument('--cache-dir', type=str, default=None, help="Directory for the on-disk feature cache. Repeat runs (also with different chunk sizes) reuse the cached analysis. Default: no cache.")
+    parser.add_argument('--audio-store', type=str, default=None, help="Directory where decoded source audio is kept as raw float32 and memory-mapped, so only the chunks used in the output are read into memory. Default: keep decoded audio in memory.")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of worker processes for the analysis phase and for pitch shifting. Default: 1.")
+    parser.add_argument('--match-jobs', type=int, default=1, help="Number of worker processes for matching. The normalized source features are shared with the workers, and the reference chunks are split between them. Needs the vectorized scan: --index 'auto' then always scans, and --index kdtree and --quantize cannot be used. Not available with --live or --sweep. Default: 1.")
+    parser.add_argument('--split-seconds', type=float, default=DEFAULT_SPLIT_SECONDS, help="With --jobs > 1, files longer than this are analyzed in time ranges of this length. Default: %(default)s")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for the random chunk boundaries, for reproducible runs. Default: unseeded.")
     parser.add_argument('--sr', type=int, default=22050, help="Sample rate to use for all processing. All files will be resampled to this rate.")
+    parser.add_argument('--stream', action='store_true', help="Streaming mode for long references: the reference is analyzed in windows and the output is matched and written block by block, so memory use does not grow with the reference length.")
+    parser.add_argument('--stream-window-seconds', type=float, default=DEFAULT_STREAM_WINDOW_SECONDS, help="With --stream, length of the reference windows decoded at a time. Default: %(default)s")
+    parser.add_argument('--sweep', action='store_true', help="Sweep mode: analyze and normalize --reference and the sources once, then render one output per combination of the --sweep-* values into --output-dir, plus a summary table of match statistics. Runs --jobs configurations at a time.")
+    parser.add_argument('--sweep-weight-rms', type=float, nargs='+', default=None, help="With --sweep, RMS weights to try. Default: --weight-rms")
+    parser.add_argument('--sweep-weight-pitch', type=float, nargs='+', default=None, help="With --sweep, pitch weights to try. Default: --weight-pitch")
+    parser.add_argument('--sweep-weight-mfcc', type=float, nargs='+', default=None, help="With --sweep, MFCC weights to try. Default: --weight-mfcc")
+    parser.add_argument('--sweep-weight-duration', type=float, nargs='+', default=None, help="With --sweep, duration weights to try. Default: --weight-duration")
+    parser.add_argument('--sweep-metrics', type=str, nargs='+', choices=['euclidean', 'cosine'], default=None, help="With --sweep, MFCC distance metrics to try. Default: --mfcc-distance-metric")
+    parser.add_argument('--sweep-summary', type=str, default=None, help="With --sweep, path of the summary CSV. Default: sweep_summary.csv in --output-dir.")
+    parser.add_argument('--live', type=str, default=None, metavar='INPUT', help="Live mode: read the reference as raw mono PCM at --sr from INPUT ('-' for stdin, or a Unix socket path to listen on) and mosaic it block by block. The output (-o, '-' for stdout) is written as each block is done.")
+    parser.add_argument('--block-seconds', type=float, default=0.5, help="With --live, duration of the blocks read from the input. Default: 0.5")
+    parser.add_argument('--pcm-format', type=str, choices=sorted(PCM_FORMATS), default='s16', help="With --live, sample format of the input, and of the output when it goes to stdout. Default: 's16'")
+    parser.add_argument('--live-report', action='store_true', help="With --live, print the processing time of every block.")
+    parser.add_argument('--metrics-out', type=str, default=None, help="Write per-phase metrics (wall and CPU time, peak memory, chunk and lookup counts and rates) to this JSON file.")
+    parser.add_argument('--profile-phase', type=str, choices=['analysis', 'normalization', 'index', 'matching', 'synthesis', 'write', 'stream', 'batch', 'live', 'sweep'], default=None, help="Run this phase under cProfile and report the result. cProfile only sees the main thread, so the matching and synthesis that the batch and sweep phases run in worker threads (and anything run in worker processes) are left out; profile a single run for those.")
+    parser.add_argument('--profile-out', type=str, default=None, help="With --profile-phase, dump the profile stats to this file instead of printing the top functions.")
     
     args = parser.parse_args()
 
+    # Validate the inputs and outputs
+    batch_jobs = None
+    if sum(x is not None for x in (args.reference, args.references, args.manifest, args.live)) != 1:
+        print("Error: give exactly one of --reference, --references, --manifest or --live.")
+        return
+    if args.live is not None:
+        if args.output is None:
+            print("Error: --output is required with --live ('-' for stdout).")
+            return
+        if args.stream:
+            print("Error: --stream and --live cannot be combined.")
+            return
+        if args.block_seconds * args.sr < N_FFT:
+            print(f"Error: --block-seconds must be at least {N_FFT / args.sr:.3f} s at this sample rate.")
+            return
+    elif args.sweep:
+        if args.reference is None:
+            print("Error: --sweep renders a single --reference.")
+            return
+        if args.output_dir is None:
+            print("Error: --output-dir is required with --sweep.")
+            return
+        if args.stream:
+            print("Error: --stream and --sweep cannot be combined.")
+            return
+        os.makedirs(args.output_dir, exist_ok=True)
+    elif args.reference is not None:
+        if args.output is None:
+            print("Error: --output is required with --reference.")
+            return
+    else:
+        try:
+            batch_jobs = read_manifest(args.manifest) if args.manifest else [(path, None) for path in args.references]
+            batch_outputs = batch_output_paths(batch_jobs, args.output_dir)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return
+        if not batch_jobs:
+            print("Error: the manifest lists no references.")
+            return
+        if args.stream:
+            print("Error: --stream renders a single --reference.")
+            return
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+
     # Validate chunk sizes
     if args.chunk_size_min >= args.chunk_size_max:
         print("Error: --chunk-size-min must be smaller than --chunk-size-max.")
@@ -327,31 +2494,114 @@ def main():
     if args.chunk_size_min <= 0:
         print("Error: --chunk-size-min must be positive.")
         return
+    if args.jobs < 1:
+        print("Error: --jobs must be at least 1.")
+        return
+    if args.split_seconds <= 0:
+        print("Error: --split-seconds must be positive.")
+        return
+    if args.pitch_quantum < 0:
+        print("Error: --pitch-quantum cannot be negative.")
+        return
+    if args.approx_candidates < 0:
+        print("Error: --approx-candidates cannot be negative.")
+        return
+    if args.match_jobs < 1:
+        print("Error: --match-jobs must be at least 1.")
+        return
+    if args.match_jobs > 1 and (args.index == 'kdtree' or args.quantize != 'none'):
+        print("Error: --match-jobs needs the vectorized scan; it cannot be combined with --index kdtree or --quantize.")
+        return
+    if args.match_jobs > 1 and (args.live is not None or args.sweep):
+        print("Error: --match-jobs is not supported with --live or --sweep.")
+        return
+    if args.rerank < 1:
+        print("Error: --rerank must be at least 1.")
+        return
+    if args.pq_subspaces < 1:
+        print("Error: --pq-subspaces must be at least 1.")
+        return
+    if args.stream_window_seconds <= 0:
+        print("Error: --stream-window-seconds must be positive.")
+        return
+    if not args.sources and not args.library:
+        print("Error: give source files with --sources, a --library, or both.")
+        return
 
     # --- 1. Analysis Phase ---
-    # Analyze the reference file
-    reference_chunks = analyze_file(args.reference, args.chunk_size_min, args.chunk_size_max, args.sr)
-    if not reference_chunks:
-        print("Could not process reference file. Exiting.")
+    cache = FeatureCache(args.cache_dir) if args.cache_dir else None
+    store = DecodedAudioStore(args.audio_store) if args.audio_store else None
+    rng = np.random.default_rng(args.seed) if args.seed is not None else None
+    metrics = RunMetrics(args.profile_phase, args.profile_out)
+    library = None
+    if args.library:
+        try:
+            library = CorpusLibrary(args.library, sample_rate=args.sr, extractor=args.extractor)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+
+    if args.live is not None:
+        # Progress messages must not end up in the audio when it goes to stdout
+        with contextlib.redirect_stdout(sys.stderr if args.output == '-' else sys.stdout):
+            live_main(args, library, cache, store, rng, metrics)
         return
 
-    # Analyze all source files and create a single pool of chunks
-    source_pool = []
-    for source_file in args.sources:
-        source_pool.extend(analyze_file(source_file, args.chunk_size_min, args.chunk_size_max, args.sr))
-    
+    with metrics.phase('analysis'):
+        # Analyze the reference file(s) and all source files. The source chunks
+        # are combined into a single pool.
+        # With a library, the sources are analyzed into the library instead
+        sources = [] if library is not None else args.sources
+        references = [reference for reference, _ in batch_jobs] if batch_jobs else [args.reference]
+        if args.stream:
+            # Only the reference's features are kept; its audio is read window by window
+            analyzed = [analyze_file_stream(args.reference, args.chunk_size_min, args.chunk_size_max, args.sr,
+                                            window_s=args.stream_window_seconds, rng=rng, extractor=args.extractor)]
+            analyzed += analyze_files(sources, args.chunk_size_min, args.chunk_size_max, args.sr, cache=cache, rng=rng,
+                                      jobs=args.jobs, split_s=args.split_seconds, store=store, extractor=args.extractor)
+        else:
+            analyzed = analyze_files(references + sources, args.chunk_size_min, args.chunk_size_max, args.sr, cache=cache,
+                                     rng=rng, jobs=args.jobs, split_s=args.split_seconds, store=store, extractor=args.extractor)
+        reference_tables = analyzed[:len(references)]
+        # In batch mode, all reference chunks together (only used for the checks and counts below)
+        reference_chunks = ChunkTable.concat(reference_tables, args.sr) if batch_jobs else reference_tables[0]
+        if batch_jobs:
+            # Only the features of the references are needed from here on
+            for table in reference_tables:
+                table.buffers = [None] * len(table.buffers)
+        if library is not None:
+            if args.sources:
+                library.add(args.sources, cache=cache, rng=rng, jobs=args.jobs, split_s=args.split_seconds)
+            source_pool = library.pool()
+        else:
+            source_pool = ChunkTable.concat(analyzed[len(references):], args.sr)
+    metrics.count('analysis', 'files', len(analyzed) + (len(library.files()) if library is not None else 0))
+    metrics.count('analysis', 'chunks', len(reference_chunks) + len(source_pool))
+
+    if not reference_chunks:
+        print("Could not process any reference file. Exiting." if batch_jobs else "Could not process reference file. Exiting.")
+        return
     if not source_pool:
         print("Could not process any source files. Exiting.")
         return
 
     # --- 2. Normalization ---
-    # Combine all chunks to normalize features across the entire dataset
-    all_chunks_for_norm = reference_chunks + source_pool
-    normalize_features(all_chunks_for_norm)
+    with metrics.phase('normalization'):
+        # Normalize features across the entire dataset (all references and the
+        # sources, so batch outputs are comparable), or with the library's
+        # range, so matches do not depend on which reference is queried
+        if library is not None:
+            library.normalize(reference_tables + [source_pool])
+        else:
+            normalize_features(reference_tables + [source_pool])
+    metrics.count('normalization', 'chunks', len(reference_chunks) + len(source_pool))
+
+    if args.sweep:
+        sweep_main(args, reference_chunks, source_pool, metrics)
+        return
 
     # --- 3. Matching Phase ---
     print("Finding best matches for each reference chunk...")
-    output_chunks = []
     
     # These weights determine the importance of matching each feature.
     # You can experiment with these values to change the output.
@@ -363,49 +2613,227 @@ def main():
         'duration': args.weight_duration
     }
 
-    for ref_chunk in tqdm(reference_chunks, desc="Finding best matches"):
-        best_source_chunk = find_best_match(ref_chunk, source_pool, feature_weights, args.duration_match, args.mfcc_distance_metric)
-        if best_source_chunk:
-            chunk_to_add = best_source_chunk
-
-            # --- Pitch Adjustment Logic (Optional) ---
-            # If enabled, this acts like an autotuner, shifting the pitch of the
-            # source chunk to match the pitch of the reference chunk.
-            if args.adjust_pitch:
-                # Get the original, non-normalized pitches in Hz
-                ref_pitch_hz = ref_chunk.features['pitch']
-                src_pitch_hz = best_source_chunk.features['pitch']
-
-                # Only attempt to shift if both pitches were detected and are valid
-                if ref_pitch_hz > 0 and src_pitch_hz > 0:
-                    # Calculate the pitch difference in semitones
-                    n_semitones = 12 * np.log2(ref_pitch_hz / src_pitch_hz)
-                    
-                    # Create a deep copy to avoid modifying the original chunk in the source pool
-                    adjusted_chunk = copy.deepcopy(best_source_chunk)
-                    
-                    # Apply pitch shifting to the audio data of the copied chunk
-                    adjusted_chunk.audio = librosa.effects.pitch_shift(
-                        y=adjusted_chunk.audio, sr=adjusted_chunk.sr, n_steps=n_semitones
-                    )
-                    chunk_to_add = adjusted_chunk
-            
-            output_chunks.append(chunk_to_add)
+    with metrics.phase('index'):
+        # The matcher packs the source pool into arrays once and scores reference
+        # chunks in blocks. For large pools a KD-tree avoids scoring every source
+        # chunk. Both select the same matches as find_best_match (unless the
+        # approximate KD-tree mode is enabled).
+        index = 'none' if args.match_jobs > 1 else args.index
+        matcher = make_matcher(source_pool, feature_weights, args.duration_match, args.mfcc_distance_metric, index=index,
+                               approx_candidates=args.approx_candidates, quantize=quantize_options(args))
+        if args.match_jobs > 1:
+            # The workers attach to the shared features when they start
+            matcher = ParallelMatcher(matcher, args.match_jobs)
+    metrics.count('index', 'source_chunks', len(source_pool))
+    if args.quantize != 'none' and args.quantize_report:
+        report_quantization(matcher, reference_chunks.norm, metrics)
+
+    if batch_jobs:
+        # One output per reference, each streamed to its file
+        fade_s = args.crossfade_duration if args.crossfade else 0
+        pitch_options = None
+        if args.adjust_pitch:
+            pitch_options = {'max_bytes': int(args.pitch_cache_mb * 1024 * 1024), 'quantum': args.pitch_quantum}
+        for (reference, _), table in zip(batch_jobs, reference_tables):
+            if not len(table):
+                print(f"Skipping {reference}: could not process the reference file.")
+        todo = [(table, output) for table, output in zip(reference_tables, batch_outputs) if len(table)]
+        with metrics.phase('batch'):
+            with contextlib.ExitStack() as stack:
+                executor = stack.enter_context(ProcessPoolExecutor(max_workers=args.jobs)) if args.adjust_pitch else None
+                results = render_batch([table for table, _ in todo], [output for _, output in todo], source_pool, matcher,
+                                       fade_s, args.sr, workers=args.jobs, pitch_options=pitch_options, executor=executor)
+        rendered = [writer for output, writer in results if not isinstance(writer, Exception)]
+        for output, writer in results:
+            if isinstance(writer, Exception):
+                print(f"Error writing {output}: {writer}")
+            else:
+                print(f"Output saved to: {output}")
+        print(f"\nRendered {len(rendered)} of {len(batch_jobs)} references.")
+        metrics.count('batch', 'references', len(rendered))
+        metrics.count('batch', 'lookups', len(reference_chunks))
+        metrics.count('batch', 'samples', sum(writer.samples for writer in rendered))
+        if args.metrics_out:
+            metrics.write(args.metrics_out, args)
+        return
+
+    if args.stream:
+        # Match and write block by block, so the output never has to fit in memory
+        fade_s = args.crossfade_duration if args.crossfade else 0
+        with metrics.phase('stream'):
+            pitch_cache = None
+            try:
+                with sf.SoundFile(args.output, 'w', samplerate=args.sr, channels=1) as out_file:
+                    if args.adjust_pitch:
+                        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                            pitch_cache = PitchShiftCache(source_pool, max_bytes=int(args.pitch_cache_mb * 1024 * 1024),
+                                                          quantum=args.pitch_quantum, executor=pool)
+                            writer = stream_segments(reference_chunks, source_pool, matcher, out_file, fade_s, args.sr, pitch_cache)
+                    else:
+                        writer = stream_segments(reference_chunks, source_pool, matcher, out_file, fade_s, args.sr)
+            except (OSError, RuntimeError) as e:
+                print(f"Error writing output file: {e}")
+                return
+        if pitch_cache is not None:
+            print(f"Pitch shift cache: {pitch_cache.hits} hits, {pitch_cache.misses} misses")
+            metrics.count('stream', 'pitch_cache_hits', pitch_cache.hits)
+            metrics.count('stream', 'pitch_cache_misses', pitch_cache.misses)
+        metrics.count('stream', 'lookups', len(reference_chunks))
+        metrics.count('stream', 'chunks', writer.segments)
+        metrics.count('stream', 'samples', writer.samples)
+        print(f"\nSuccess! Output saved to: {args.output}")
+        if args.metrics_out:
+            metrics.write(args.metrics_out, args)
+        return
+
+    with metrics.phase('matching'):
+        if args.adjust_pitch:
+            # Shifts run in worker processes while matching continues
+            with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                pitch_cache = PitchShiftCache(source_pool, max_bytes=int(args.pitch_cache_mb * 1024 * 1024),
+                                              quantum=args.pitch_quantum, executor=pool)
+                output_segments = render_segments(reference_chunks, source_pool, matcher, pitch_cache, progress=True)
+            print(f"Pitch shift cache: {pitch_cache.hits} hits, {pitch_cache.misses} misses")
+            metrics.count('matching', 'pitch_cache_hits', pitch_cache.hits)
+            metrics.count('matching', 'pitch_cache_misses', pitch_cache.misses)
+        else:
+            output_segments = render_segments(reference_chunks, source_pool, matcher, progress=True)
+    metrics.count('matching', 'lookups', len(reference_chunks))
 
     # --- 4. Synthesis Phase ---
-    if args.crossfade:
-        final_audio = concatenate_with_crossfade(output_chunks, args.crossfade_duration, args.sr)
-    else:
-        print("Synthesizing output file (no crossfade)...")
-        # Concatenate the audio data from the chosen chunks
-        final_audio = np.concatenate([chunk.audio for chunk in output_chunks])
+    with metrics.phase('synthesis'):
+        if args.crossfade:
+            final_audio = concatenate_with_crossfade(output_segments, args.crossfade_duration, args.sr)
+        else:
+            print("Synthesizing output file (no crossfade)...")
+            # Concatenate the audio data from the chosen chunks
+            final_audio = np.concatenate(output_segments)
+    metrics.count('synthesis', 'chunks', len(output_segments))
+    metrics.count('synthesis', 'samples', len(final_audio))
     
     # Write the final audio to a file
     try:
-        sf.write(args.output, final_audio, args.sr)
+        with metrics.phase('write'):
+            sf.write(args.output, final_audio, args.sr)
         print(f"\nSuccess! Output saved to: {args.output}")
     except Exception as e:
         print(f"Error writing output file: {e}")
 
+    if args.metrics_out:
+        metrics.write(args.metrics_out, args)
+
+def quantize_options(args):
+    """QuantizedMatcher keyword arguments for --quantize, or None if it is off."""
+    if args.quantize == 'none':
+        return None
+    return {'mode': args.quantize, 'rerank': args.rerank, 'pq_subspaces': args.pq_subspaces,
+            'seed': args.seed if args.seed is not None else 0}
+
+def report_quantization(matcher, reference_features, metrics):
+    """Prints (and records in the metrics) the memory savings and recall of a QuantizedMatcher."""
+    report = quantization_report(matcher, reference_features)
+    print(f"Quantized features ({report['mode']}): {report['compressed_bytes'] / 1e6:.2f} MB instead of "
+          f"{report['exact_bytes'] / 1e6:.2f} MB ({report['compression']:.1f}x smaller), recall {100 * report['recall']:.2f}% "
+          f"with {report['rerank']} candidates re-ranked.")
+    metrics.record('index', 'quantization', report)
+
+def sweep_main(args, reference_chunks, source_pool, metrics):
+    """The --sweep mode of main: renders the analyzed reference once per configuration and writes the summary."""
+    weight_grid = OrderedDict([
+        ('rms', args.sweep_weight_rms or [args.weight_rms]),
+        ('pitch', args.sweep_weight_pitch or [args.weight_pitch]),
+        ('mfcc', args.sweep_weight_mfcc or [args.weight_mfcc]),
+        ('duration', args.sweep_weight_duration or [args.weight_duration]),
+    ])
+    configs = sweep_configs(weight_grid, args.sweep_metrics or [args.mfcc_distance_metric])
+    output_paths = [sweep_output_path(args.output_dir, args.reference, weights, metric) for weights, metric in configs]
+    print(f"Sweeping {len(configs)} configurations...")
+
+    fade_s = args.crossfade_duration if args.crossfade else 0
+    pitch_options = None
+    if args.adjust_pitch:
+        pitch_options = {'max_bytes': int(args.pitch_cache_mb * 1024 * 1024), 'quantum': args.pitch_quantum}
+    with metrics.phase('sweep'):
+        with contextlib.ExitStack() as stack:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=args.jobs)) if args.adjust_pitch else None
+            results = render_sweep(reference_chunks, source_pool, configs, output_paths, args.duration_match, fade_s, args.sr,
+                                   index=args.index, approx_candidates=args.approx_candidates, quantize=quantize_options(args),
+                                   workers=args.jobs,
+                                   pitch_options=pitch_options, executor=executor)
+
+    summary_path = args.sweep_summary or os.path.join(args.output_dir, 'sweep_summary.csv')
+    write_sweep_summary(summary_path, configs, results)
+    print(f"\n{'rms':>6} {'pitch':>6} {'mfcc':>6} {'dur':>6} {'metric':>9} {'unique':>7} {'reuse':>6} {'mfcc_dist':>9} {'pitch_st':>8}")
+    for (weights, metric), (output, stats) in zip(configs, results):
+        if isinstance(stats, Exception):
+            print(f"Error writing {output}: {stats}")
+            continue
+        pitch_error = f"{stats['pitch_error_st']:8.3f}" if stats['pitch_error_st'] != '' else f"{'-':>8}"
+        print(f"{weights['rms']:6g} {weights['pitch']:6g} {weights['mfcc']:6g} {weights['duration']:6g} {metric:>9} "
+              f"{stats['unique_sources']:7d} {stats['max_reuse']:6d} {stats['mfcc_distance']:9.4f} {pitch_error}")
+    rendered = sum(not isinstance(stats, Exception) for _, stats in results)
+    print(f"\nRendered {rendered} of {len(configs)} configurations into {args.output_dir}; summary saved to: {summary_path}")
+    metrics.count('sweep', 'configurations', rendered)
+    metrics.count('sweep', 'lookups', rendered * len(reference_chunks))
+    if args.metrics_out:
+        metrics.write(args.metrics_out, args)
+
+def live_main(args, library, cache, store, rng, metrics):
+    """The --live mode of main: loads and indexes the source pool, then mosaics the input stream until it ends."""
+    with metrics.phase('analysis'):
+        source_pool, ranges = load_source_pool(args.sources, args.chunk_size_min, args.chunk_size_max, args.sr,
+                                               library=library, cache=cache, rng=rng, jobs=args.jobs,
+                                               split_s=args.split_seconds, store=store, extractor=args.extractor)
+    metrics.count('analysis', 'chunks', len(source_pool))
+    if not source_pool:
+        print("Could not process any source files. Exiting.")
+        return
+
+    feature_weights = {'rms': args.weight_rms, 'pitch': args.weight_pitch, 'mfcc': args.weight_mfcc, 'duration': args.weight_duration}
+    with metrics.phase('index'):
+        matcher = make_matcher(source_pool, feature_weights, args.duration_match, args.mfcc_distance_metric, index=args.index,
+                               approx_candidates=args.approx_candidates, quantize=quantize_options(args))
+    metrics.count('index', 'source_chunks', len(source_pool))
+
+    # Pitch shifts run inline: handing single chunks to worker processes costs more than it saves
+    pitch_cache = None
+    if args.adjust_pitch:
+        pitch_cache = PitchShiftCache(source_pool, max_bytes=int(args.pitch_cache_mb * 1024 * 1024), quantum=args.pitch_quantum)
+    fade_s = args.crossfade_duration if args.crossfade else 0
+    block_samples = int(args.block_seconds * args.sr)
+
+    try:
+        stream, cleanup = open_live_input(args.live)
+    except OSError as e:
+        print(f"Error opening the live input: {e}")
+        return
+    print(f"Live: {len(source_pool)} source chunks, blocks of {1000 * block_samples / args.sr:.0f} ms at {args.sr} Hz.", file=sys.stderr)
+    try:
+        with contextlib.ExitStack() as stack:
+            if args.output == '-':
+                out_file = RawPCMWriter(sys.__stdout__.buffer, args.pcm_format)
+            else:
+                out_file = stack.enter_context(sf.SoundFile(args.output, 'w', samplerate=args.sr, channels=1))
+            live = LiveMosaic(source_pool, ranges, matcher, out_file, args.sr, args.chunk_size_min, args.chunk_size_max,
+                              fade_s, extractor=args.extractor, rng=rng, pitch_cache=pitch_cache)
+            with metrics.phase('live'):
+                report = run_live(live, stream, block_samples, args.pcm_format, report=args.live_report)
+    except (OSError, RuntimeError) as e:
+        print(f"Error in live mode: {e}", file=sys.stderr)
+        return
+    finally:
+        cleanup()
+
+    if report['blocks']:
+        print(f"Live: {report['blocks']} blocks of {report['block_ms']:.0f} ms, processing mean {report['mean_processing_ms']:.1f} ms, "
+              f"p95 {report['p95_processing_ms']:.1f} ms, max {report['max_processing_ms']:.1f} ms "
+              f"(peak load {100 * report['max_load']:.0f}%, {report['overruns']} overruns). "
+              f"Worst-case latency: {report['max_latency_ms']:.0f} ms.", file=sys.stderr)
+    metrics.count('live', 'blocks', report['blocks'])
+    metrics.count('live', 'samples', live.writer.samples)
+    metrics.record('live', 'latency', report)
+    if args.metrics_out:
+        metrics.write(args.metrics_out, args)
+
 if __name__ == '__main__':
     main()
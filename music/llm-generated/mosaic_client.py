@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Mosaic Client
+
+Sends a reference file to a running mosaic_server.py and writes the audio it
+streams back to an output file as it arrives. The matching options are the
+same as in mosaic.py; the sources, sample rate and feature extractor are
+those the server was started with.
+
+Only needs numpy and soundfile, so it starts quickly.
+
+Usage:
+
+python mosaic_client.py --url http://127.0.0.1:8765 -r reference.wav -o output.wav --weight-pitch 2.0
+python mosaic_client.py --socket /tmp/mosaic.sock -r reference.wav -o output.wav --adjust-pitch
+"""
+
+import argparse
+import http.client
+import os
+import socket
+import sys
+import time
+from urllib.parse import urlencode, urlparse
+
+import numpy as np
+import soundfile as sf
+
+# Bytes read from the response at a time.
+READ_BYTES = 64 * 1024
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a local Unix socket."""
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def connect(args):
+    if args.socket:
+        return UnixHTTPConnection(args.socket, timeout=args.timeout)
+    url = urlparse(args.url)
+    return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=args.timeout)
+
+def main():
+    parser = argparse.ArgumentParser(description="Renders a reference file on a running mosaic_server.py.")
+    parser.add_argument('-r', '--reference', type=str, help="Path to the reference audio file.")
+    parser.add_argument('-o', '--output', type=str, help="Path for the output audio file.")
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8765', help="URL of the server. Default: http://127.0.0.1:8765")
+    parser.add_argument('--socket', type=str, default=None, help="Connect to the server's Unix socket instead of --url.")
+    parser.add_argument('--status', action='store_true', help="Print the server status and exit.")
+    parser.add_argument('--chunk-size-min', type=float, default=0.1, help="Minimum duration of each reference chunk in seconds. Default: 0.1")
+    parser.add_argument('--chunk-size-max', type=float, default=0.4, help="Maximum duration of each reference chunk in seconds. Default: 0.4")
+    parser.add_argument('--no-crossfade', dest='crossfade', action='store_false', help="Disable crossfading between chunks.")
+    parser.add_argument('--mfcc-distance-metric', type=str, choices=['euclidean', 'cosine'], default='euclidean', help="Distance metric for MFCCs. Default: 'euclidean'.")
+    parser.add_argument('--weight-rms', type=float, default=1.0, help="Weight for RMS (loudness) matching. Default: 1.0")
+    parser.add_argument('--weight-pitch', type=float, default=1.5, help="Weight for pitch matching. Default: 1.5")
+    parser.add_argument('--weight-mfcc', type=float, default=1.0, help="Weight for MFCC (timbre) matching. Default: 1.0")
+    parser.add_argument('--weight-duration', type=float, default=0.5, help="Weight for duration matching. Default: 0.5")
+    parser.add_argument('--crossfade-duration', type=float, default=0.01, help="Duration of the crossfade in seconds. Default: 0.01")
+    parser.add_argument('--no-chunk-duration-match', dest='duration_match', action='store_false', help="Disable matching based on chunk duration.")
+    parser.add_argument('--adjust-pitch', action='store_true', help="Adjust the pitch of each source chunk to match the reference chunk.")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for the random chunk boundaries of the reference. Default: unseeded.")
+    parser.add_argument('--timeout', type=float, default=None, help="Socket timeout in seconds. Default: none.")
+    args = parser.parse_args()
+
+    connection = connect(args)
+    if args.status:
+        connection.request('GET', '/status')
+        response = connection.getresponse()
+        print(response.read().decode('utf-8'))
+        return
+
+    if not args.reference or not args.output:
+        print("Error: --reference and --output are required.")
+        return
+
+    if not os.path.exists(args.reference):
+        print(f"Error: reference file not found: {args.reference}")
+        return
+
+    options = {
+        'weight_rms': args.weight_rms,
+        'weight_pitch': args.weight_pitch,
+        'weight_mfcc': args.weight_mfcc,
+        'weight_duration': args.weight_duration,
+        'mfcc_distance_metric': args.mfcc_distance_metric,
+        'crossfade_duration': args.crossfade_duration,
+        'chunk_size_min': args.chunk_size_min,
+        'chunk_size_max': args.chunk_size_max,
+    }
+    if not args.crossfade:
+        options['no_crossfade'] = 1
+    if not args.duration_match:
+        options['no_chunk_duration_match'] = 1
+    if args.adjust_pitch:
+        options['adjust_pitch'] = 1
+    if args.seed is not None:
+        options['seed'] = args.seed
+
+    start = time.perf_counter()
+    try:
+        with open(args.reference, 'rb') as f:
+            connection.request('POST', '/mosaic?' + urlencode(options), body=f,
+                               headers={'Content-Length': str(os.path.getsize(args.reference)),
+                                        'Content-Type': 'application/octet-stream'})
+        response = connection.getresponse()
+    except OSError as e:
+        print(f"Error: could not reach the server: {e}")
+        return
+    if response.status != 200:
+        print(f"Server error {response.status}: {response.read().decode('utf-8', 'replace').strip()}")
+        return
+
+    sample_rate = int(response.getheader('X-Sample-Rate'))
+    first_audio = None
+    n_samples = 0
+    pending = b''
+    try:
+        with sf.SoundFile(args.output, 'w', samplerate=sample_rate, channels=1) as out_file:
+            while True:
+                data = response.read1(READ_BYTES) if hasattr(response, 'read1') else response.read(READ_BYTES)
+                if not data:
+                    break
+                if first_audio is None:
+                    first_audio = time.perf_counter() - start
+                # Samples can be split across reads
+                pending += data
+                usable = len(pending) // 4 * 4
+                samples = np.frombuffer(pending[:usable], dtype='<f4')
+                pending = pending[usable:]
+                out_file.write(samples)
+                n_samples += len(samples)
+    except http.client.IncompleteRead:
+        print("Error: the server ended the stream early; the output is incomplete.")
+        sys.exit(1)
+
+    total = time.perf_counter() - start
+    print(f"Output saved to: {args.output} ({n_samples / sample_rate:.2f} s of audio, first audio after "
+          f"{first_audio or 0:.2f} s, done after {total:.2f} s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Corpus Library Manager for mosaic.py
+
+Builds and maintains a persistent library of analyzed source files (see
+CorpusLibrary in mosaic.py). Files can be added or removed one at a time:
+only the files that are new or changed are analyzed, and the library keeps
+running per-feature statistics, so it never has to be rebuilt as a whole.
+The library stores no search index: mosaic.py builds its KD-tree over the
+whole library on every run (see CorpusLibrary).
+
+The library is then used as the source pool with `mosaic.py --library DIR`.
+
+Dependencies:
+Same as mosaic.py, which must be in the same directory.
+
+Usage:
+
+python mosaic_library.py path/to/library add path/to/source1.wav path/to/source2.wav
+python mosaic_library.py path/to/library remove path/to/source1.wav
+python mosaic_library.py path/to/library list
+python mosaic_library.py path/to/library stats
+
+The sample rate, chunk sizes and feature extractor are chosen when the first
+files are added (--sr, --chunk-size-min, --chunk-size-max, --extractor) and
+are fixed from then on.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from mosaic import (CorpusLibrary, FeatureCache, FEATURE_EXTRACTORS, DEFAULT_SPLIT_SECONDS, RMS_COLUMN, PITCH_COLUMN,
+                    MFCC_COLUMNS, DURATION_COLUMN)
+
+def print_stats(library):
+    stats = library.stats()
+    if stats is None:
+        print("The library is empty.")
+        return
+    print(f"{len(library.files())} files, {stats['count']} chunks, settings: {library.settings}")
+    names = ['rms', 'pitch'] + [f'mfcc{i}' for i in range(MFCC_COLUMNS.stop - MFCC_COLUMNS.start)] + ['duration']
+    columns = [RMS_COLUMN, PITCH_COLUMN] + list(range(MFCC_COLUMNS.start, MFCC_COLUMNS.stop)) + [DURATION_COLUMN]
+    print(f"{'feature':>10} {'min':>12} {'max':>12} {'mean':>12} {'std':>12}")
+    for name, column in zip(names, columns):
+        print(f"{name:>10} {stats['min'][column]:12.4f} {stats['max'][column]:12.4f} {stats['mean'][column]:12.4f} {stats['std'][column]:12.4f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Manages a persistent corpus library for mosaic.py.")
+    parser.add_argument('library', type=str, help="Directory of the library. Created on first use.")
+    parser.add_argument('command', choices=['add', 'remove', 'list', 'stats'], help="'add' or 'remove' files, 'list' the files, or show feature 'stats'.")
+    parser.add_argument('files', nargs='*', help="Audio files to add or remove.")
+    parser.add_argument('--sr', type=int, default=None, help="Sample rate of a new library. Default: 22050")
+    parser.add_argument('--chunk-size-min', type=float, default=None, help="Minimum chunk duration of a new library, in seconds. Default: 0.1")
+    parser.add_argument('--chunk-size-max', type=float, default=None, help="Maximum chunk duration of a new library, in seconds. Default: 0.4")
+    parser.add_argument('--extractor', type=str, choices=sorted(FEATURE_EXTRACTORS), default=None, help="Feature extractor of a new library. Default: 'accurate'")
+    parser.add_argument('--cache-dir', type=str, default=None, help="Feature cache directory shared with mosaic.py. Default: no cache.")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of worker processes for the analysis. Default: 1.")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for the random chunk boundaries. Default: unseeded.")
+    args = parser.parse_args()
+
+    if args.command in ('add', 'remove') and not args.files:
+        print(f"Error: '{args.command}' needs at least one file.")
+        return
+    if args.jobs < 1:
+        print("Error: --jobs must be at least 1.")
+        return
+    if args.command in ('list', 'stats') and not os.path.exists(os.path.join(args.library, CorpusLibrary.MANIFEST)):
+        print(f"Error: no library found in {args.library}.")
+        return
+
+    try:
+        library = CorpusLibrary(args.library, sample_rate=args.sr, chunk_duration_min_s=args.chunk_size_min,
+                                chunk_duration_max_s=args.chunk_size_max, extractor=args.extractor)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    if args.command == 'add':
+        cache = FeatureCache(args.cache_dir) if args.cache_dir else None
+        rng = np.random.default_rng(args.seed) if args.seed is not None else None
+        added = library.add(args.files, cache=cache, rng=rng, jobs=args.jobs, split_s=DEFAULT_SPLIT_SECONDS)
+        print(f"Added {len(added)} file(s); the library now has {len(library.files())} files and {len(library)} chunks.")
+    elif args.command == 'remove':
+        removed = library.remove(args.files)
+        print(f"Removed {len(removed)} file(s); the library now has {len(library.files())} files and {len(library)} chunks.")
+    elif args.command == 'list':
+        for path, entry in library.entries.items():
+            print(f"{entry['chunks']:8d}  {path}")
+    else:
+        print_stats(library)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Mosaic Server
+
+Long-running version of mosaic.py: the source corpus is decoded, analyzed,
+normalized and indexed once at startup, and reference jobs are then accepted
+over HTTP, either on a TCP port or on a local Unix socket. Each job only pays
+for analyzing its reference and for matching and synthesis. The rendered
+audio is streamed back while it is being synthesized.
+
+Jobs run concurrently, one thread each, against the shared read-only corpus.
+With --jobs > 1, reference analysis (and pitch shifting) run in a pool of
+worker processes, so concurrent jobs are not serialized by the interpreter.
+
+The source pool is normalized with its own feature range, and references are
+normalized with that same range, so the result of a job does not depend on
+which other jobs run. (Single runs of mosaic.py normalize over the reference
+and the sources together, so their output can differ slightly.)
+
+Protocol (see mosaic_client.py):
+
+- POST /mosaic with the reference audio file as the request body and the
+  options as query parameters (weight_rms, weight_pitch, weight_mfcc,
+  weight_duration, mfcc_distance_metric, crossfade_duration, no_crossfade,
+  no_chunk_duration_match, adjust_pitch, chunk_size_min, chunk_size_max,
+  seed). The response streams mono float32 little-endian samples with
+  chunked transfer encoding; the sample rate is in the X-Sample-Rate header.
+- GET /status returns the corpus size and job counters as JSON.
+
+Dependencies:
+Same as mosaic.py, which must be in the same directory.
+
+Usage:
+
+python mosaic_server.py --sources path/to/source1.wav path/to/source2.wav --port 8765
+python mosaic_server.py --library path/to/library --socket /tmp/mosaic.sock --jobs 4
+"""
+
+import argparse
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from mosaic import (CorpusLibrary, DecodedAudioStore, FeatureCache, FEATURE_EXTRACTORS, DEFAULT_EXTRACTOR, PitchShiftCache,
+                    analyze_file, load_source_pool, make_matcher, normalize_features, stream_segments)
+
+# Matchers (one per weight/metric setting) kept for reuse across jobs.
+MAX_MATCHERS = 8
+
+# Largest reference file accepted, in bytes.
+MAX_REFERENCE_BYTES = 512 * 1024 * 1024
+
+def analyze_reference_features(path, chunk_duration_min_s, chunk_duration_max_s, sample_rate, rng, extractor):
+    """
+    Analyzes a reference file and returns its chunks without their audio: only
+    the features are used for matching and synthesis, so a worker process does
+    not send the decoded reference back to the server.
+    """
+    table = analyze_file(path, chunk_duration_min_s, chunk_duration_max_s, sample_rate, rng=rng, extractor=extractor)
+    table.buffers = [None] * len(table.buffers)
+    return table
+
+class MosaicCorpus:
+    """
+    The shared, read-only state of the server: the normalized source pool and
+    the matchers built for it.
+
+    Matchers are built on first use for each weight/metric setting and kept
+    (up to MAX_MATCHERS), so later jobs with the same setting reuse the index.
+    """
+    def __init__(self, source_pool, ranges, sample_rate, extractor, index='auto', approx_candidates=0, executor=None,
+                 pitch_cache_mb=256, pitch_quantum=0.05):
+        self.source_pool = source_pool
+        self.ranges = ranges
+        self.sr = sample_rate
+        self.extractor = extractor
+        self.index = index
+        self.approx_candidates = approx_candidates
+        self.executor = executor
+        self.pitch_cache_mb = pitch_cache_mb
+        self.pitch_quantum = pitch_quantum
+        self._matchers = OrderedDict()
+        self._lock = threading.Lock()
+        self.active_jobs = 0
+        self.finished_jobs = 0
+        self.failed_jobs = 0
+
+    def matcher(self, feature_weights, use_duration_match, mfcc_distance_metric):
+        key = (tuple(sorted(feature_weights.items())), bool(use_duration_match), mfcc_distance_metric)
+        with self._lock:
+            if key in self._matchers:
+                self._matchers.move_to_end(key)
+                return self._matchers[key]
+            matcher = make_matcher(self.source_pool, feature_weights, use_duration_match, mfcc_distance_metric,
+                                   index=self.index, approx_candidates=self.approx_candidates)
+            self._matchers[key] = matcher
+            while len(self._matchers) > MAX_MATCHERS:
+                self._matchers.popitem(last=False)
+            return matcher
+
+    def analyze_reference(self, path, chunk_duration_min_s, chunk_duration_max_s, rng):
+        """Analyzes a reference file (in the worker pool, if any) and normalizes it with the pool's range."""
+        args = (path, chunk_duration_min_s, chunk_duration_max_s, self.sr, rng, self.extractor)
+        if self.executor is not None:
+            reference_chunks = self.executor.submit(analyze_reference_features, *args).result()
+        else:
+            reference_chunks = analyze_reference_features(*args)
+        normalize_features([reference_chunks], ranges=self.ranges)
+        return reference_chunks
+
+    def count_job(self, counter, delta):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + delta)
+
+    def status(self):
+        return {
+            'source_chunks': len(self.source_pool),
+            'source_files': len(self.source_pool.buffers),
+            'sr': self.sr,
+            'extractor': self.extractor,
+            'active_jobs': self.active_jobs,
+            'finished_jobs': self.finished_jobs,
+            'failed_jobs': self.failed_jobs,
+        }
+
+class ChunkedAudioWriter:
+    """Sends samples as mono float32 little-endian HTTP chunks (see StreamingCrossfader)."""
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, samples):
+        data = np.asarray(samples, dtype='<f4').tobytes()
+        if data:
+            self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+            self.wfile.flush()
+
+    def close(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+def _option(query, name, convert, default):
+    values = query.get(name)
+    return convert(values[-1]) if values else default
+
+def _flag(value):
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+class MosaicRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MosaicServer/1.0'
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def _send_text(self, status, message, content_type='text/plain; charset=utf-8'):
+        body = message.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reject(self, status, message, length):
+        """Sends an error before the request body was read, skipping the body so the connection stays usable."""
+        if 0 < length <= MAX_REFERENCE_BYTES:
+            while length:
+                data = self.rfile.read(min(length, 1024 * 1024))
+                if not data:
+                    break
+                length -= len(data)
+        else:
+            self.close_connection = True
+        self._send_text(status, message)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/status':
+            self._send_text(200, json.dumps(self.server.corpus.status()), 'application/json')
+        else:
+            self._send_text(404, "Not found. Use POST /mosaic or GET /status.\n")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/mosaic':
+            self._send_text(404, "Not found. Use POST /mosaic or GET /status.\n")
+            return
+
+        corpus = self.server.corpus
+        query = parse_qs(url.query)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        try:
+            feature_weights = {
+                'rms': _option(query, 'weight_rms', float, 1.0),
+                'pitch': _option(query, 'weight_pitch', float, 1.5),
+                'mfcc': _option(query, 'weight_mfcc', float, 1.0),
+                'duration': _option(query, 'weight_duration', float, 0.5),
+            }
+            metric = _option(query, 'mfcc_distance_metric', str, 'euclidean')
+            duration_match = not _option(query, 'no_chunk_duration_match', _flag, False)
+            fade_s = 0 if _option(query, 'no_crossfade', _flag, False) else _option(query, 'crossfade_duration', float, 0.01)
+            adjust_pitch = _option(query, 'adjust_pitch', _flag, False)
+            chunk_size_min = _option(query, 'chunk_size_min', float, 0.1)
+            chunk_size_max = _option(query, 'chunk_size_max', float, 0.4)
+            seed = _option(query, 'seed', int, None)
+        except ValueError as e:
+            self._reject(400, f"Error: invalid option: {e}\n", length)
+            return
+        if metric not in ('euclidean', 'cosine'):
+            self._reject(400, "Error: mfcc_distance_metric must be 'euclidean' or 'cosine'.\n", length)
+            return
+        if not 0 < chunk_size_min < chunk_size_max:
+            self._reject(400, "Error: chunk sizes must satisfy 0 < chunk_size_min < chunk_size_max.\n", length)
+            return
+        if not 0 < length <= MAX_REFERENCE_BYTES:
+            self._reject(400 if length <= 0 else 413, "Error: the request body must contain the reference audio file.\n", length)
+            return
+
+        corpus.count_job('active_jobs', +1)
+        start = time.perf_counter()
+        tmp_path = None
+        headers_sent = False
+        try:
+            # The reference is analyzed from a file, so any format soundfile/librosa reads works
+            with tempfile.NamedTemporaryFile(suffix='.audio', delete=False) as f:
+                tmp_path = f.name
+                remaining = length
+                while remaining:
+                    data = self.rfile.read(min(remaining, 1024 * 1024))
+                    if not data:
+                        raise ConnectionError("Connection closed while receiving the reference.")
+                    f.write(data)
+                    remaining -= len(data)
+
+            rng = np.random.default_rng(seed) if seed is not None else None
+            reference_chunks = corpus.analyze_reference(tmp_path, chunk_size_min, chunk_size_max, rng)
+            if not reference_chunks:
+                raise ValueError("Could not process the reference file.")
+            matcher = corpus.matcher(feature_weights, duration_match, metric)
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('X-Sample-Rate', str(corpus.sr))
+            self.send_header('X-Channels', '1')
+            self.send_header('X-Sample-Format', 'float32le')
+            self.send_header('X-Reference-Chunks', str(len(reference_chunks)))
+            self.end_headers()
+            headers_sent = True
+
+            pitch_cache = None
+            if adjust_pitch:
+                pitch_cache = PitchShiftCache(corpus.source_pool, max_bytes=int(corpus.pitch_cache_mb * 1024 * 1024),
+                                              quantum=corpus.pitch_quantum, executor=corpus.executor)
+            writer = ChunkedAudioWriter(self.wfile)
+            stream_segments(reference_chunks, corpus.source_pool, matcher, writer, fade_s, corpus.sr, pitch_cache,
+                            progress=False)
+            writer.close()
+            corpus.count_job('finished_jobs', +1)
+            self.log_message("Job done: %d reference chunks in %.2f s", len(reference_chunks), time.perf_counter() - start)
+        except (ConnectionError, BrokenPipeError) as e:
+            corpus.count_job('failed_jobs', +1)
+            self.log_message("Job aborted: %s", e)
+            self.close_connection = True
+        except Exception as e:
+            corpus.count_job('failed_jobs', +1)
+            self.log_message("Job failed: %s", e)
+            if headers_sent:
+                # Headers are already sent; all that can be done is to cut the stream short.
+                self.close_connection = True
+            else:
+                self._send_text(400, f"Error: {e}\n")
+        finally:
+            corpus.count_job('active_jobs', -1)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        # Attributes BaseHTTPRequestHandler expects from an HTTPServer
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+def load_corpus(args, executor):
+    """Analyzes, normalizes and indexes the source corpus once. Returns a MosaicCorpus, or None on error."""
+    rng = np.random.default_rng(args.seed) if args.seed is not None else None
+    cache = FeatureCache(args.cache_dir) if args.cache_dir else None
+
+    store = DecodedAudioStore(args.audio_store) if args.audio_store else None
+    library = None
+    if args.library:
+        try:
+            library = CorpusLibrary(args.library, sample_rate=args.sr, extractor=args.extractor)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return None
+    source_pool, ranges = load_source_pool(args.sources, args.chunk_size_min, args.chunk_size_max, args.sr, library=library,
+                                           cache=cache, rng=rng, jobs=args.jobs, store=store, extractor=args.extractor)
+    if not source_pool:
+        print("Could not process any source files. Exiting.")
+        return None
+
+    corpus = MosaicCorpus(source_pool, ranges, args.sr, args.extractor, index=args.index,
+                          approx_candidates=args.approx_candidates, executor=executor,
+                          pitch_cache_mb=args.pitch_cache_mb, pitch_quantum=args.pitch_quantum)
+    # Build the default matcher now, so the first job does not pay for it
+    corpus.matcher({'rms': 1.0, 'pitch': 1.5, 'mfcc': 1.0, 'duration': 0.5}, True, 'euclidean')
+    return corpus
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves mosaic.py jobs against a source corpus that is analyzed once.")
+    parser.add_argument('-s', '--sources', nargs='+', default=[], help="Paths to one or more source audio files.")
+    parser.add_argument('--library', type=str, default=None, help="Corpus library (see mosaic_library.py) to serve. Files given with --sources are added to it first.")
+    parser.add_argument('--socket', type=str, default=None, help="Listen on this Unix socket path.")
+    parser.add_argument('--host', type=str, default='127.0.0.1', help="Host to listen on for HTTP. Default: 127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port to listen on, unless --socket is given. Default: 8765")
+    parser.add_argument('--chunk-size-min', type=float, default=0.1, help="Minimum source chunk duration in seconds. Default: 0.1")
+    parser.add_argument('--chunk-size-max', type=float, default=0.4, help="Maximum source chunk duration in seconds. Default: 0.4")
+    parser.add_argument('--index', type=str, choices=['auto', 'kdtree', 'none'], default='auto', help="Search structure for matching, as in mosaic.py. Default: 'auto'.")
+    parser.add_argument('--approx-candidates', type=int, default=0, help="Approximate KD-tree matching, as in mosaic.py. Default: 0 (exact).")
+    parser.add_argument('--extractor', type=str, choices=sorted(FEATURE_EXTRACTORS), default=DEFAULT_EXTRACTOR, help="Feature extractor for sources and references. Default: '%s'." % DEFAULT_EXTRACTOR)
+    parser.add_argument('--pitch-quantum', type=float, default=0.05, help="Semitone rounding for jobs with adjust_pitch. Default: 0.05")
+    parser.add_argument('--pitch-cache-mb', type=float, default=256, help="Memory limit for the pitch shift cache of each job, in MB. Default: 256")
+    parser.add_argument('--cache-dir', type=str, default=None, help="Directory for the on-disk feature cache. Default: no cache.")
+    parser.add_argument('--audio-store', type=str, default=None, help="Directory where decoded source audio is memory-mapped from. Default: keep it in memory.")
+    parser.add_argument('--jobs', type=int, default=1, help="Worker processes for analysis and pitch shifting. Default: 1 (analyze in the job's thread).")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for the source chunk boundaries. Default: unseeded.")
+    parser.add_argument('--sr', type=int, default=22050, help="Sample rate to use for all processing. Default: 22050")
+    args = parser.parse_args()
+
+    if not args.sources and not args.library:
+        print("Error: give source files with --sources, a --library, or both.")
+        return
+    if args.chunk_size_min <= 0 or args.chunk_size_min >= args.chunk_size_max:
+        print("Error: chunk sizes must satisfy 0 < --chunk-size-min < --chunk-size-max.")
+        return
+    if args.jobs < 1:
+        print("Error: --jobs must be at least 1.")
+        return
+
+    executor = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+    try:
+        corpus = load_corpus(args, executor)
+        if corpus is None:
+            return
+
+        if args.socket:
+            if os.path.exists(args.socket):
+                os.remove(args.socket)
+            server = ThreadingUnixHTTPServer(args.socket, MosaicRequestHandler)
+            where = f"unix socket {args.socket}"
+        else:
+            server = ThreadingHTTPServer((args.host, args.port), MosaicRequestHandler)
+            where = f"http://{args.host}:{server.server_port}"
+        server.corpus = corpus
+        print(f"Serving {len(corpus.source_pool)} source chunks on {where}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nShutting down.")
+        finally:
+            server.server_close()
+            if args.socket and os.path.exists(args.socket):
+                os.remove(args.socket)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+if __name__ == '__main__':
+    main()
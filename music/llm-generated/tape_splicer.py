@@ -1,8 +1,16 @@
 #!/usr/bin/env python3
 
+import argparse
+import contextlib
 import sys
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import soundfile as sf
 from pydub import AudioSegment
 from pydub.exceptions import CouldntDecodeError
+from pydub.utils import mediainfo_json
 import math
 
 # --- Configuration ---
@@ -12,6 +20,354 @@ import math
 # A 90-degree cut results in no fade.
 MAX_FADE_EFFECT_MS = 50.0
 
+# Default memory limit for decoded source files kept between splice lines.
+DEFAULT_CACHE_MB = 512
+
+# Default length of the blocks written by --stream, in seconds.
+DEFAULT_BLOCK_SECONDS = 10.0
+
+# The output starts as silence in this format; segments in a higher frame rate,
+# more channels or a larger sample width raise the output format to theirs.
+OUTPUT_FRAME_RATE = 11025
+OUTPUT_CHANNELS = 1
+OUTPUT_SAMPLE_WIDTH = 2
+
+# Sample width pydub decodes each soundfile subtype to: 24-bit audio is loaded
+# as 32-bit, and ffmpeg converts float samples to 32-bit integers.
+DECODED_SAMPLE_WIDTHS = {'PCM_S8': 1, 'PCM_U8': 1, 'PCM_16': 2, 'PCM_24': 4, 'PCM_32': 4, 'FLOAT': 4}
+
+# soundfile subtypes whose samples are read straight from the requested frames,
+# since pydub would load them unchanged. Anything else is decoded whole.
+PARTIAL_READ_SUBTYPES = ('PCM_16', 'PCM_24', 'PCM_32')
+
+# Codecs ffprobe reports as float planar although pydub decodes them to 16 bits.
+FLTP_16_BIT_CODECS = ('mp3', 'mp4', 'aac', 'webm', 'ogg')
+
+# Extra audio read on each side of a window that has to be resampled, so the
+# resampler has settled by the first frame that is kept.
+PARTIAL_READ_MARGIN_MS = 20
+
+# numpy types of pydub's raw samples (signed, 24-bit audio is loaded as 32-bit), by sample width.
+SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+class MixBus:
+    """
+    The output, or the part of it from first_frame on, as one preallocated
+    float buffer of (frames, channels).
+
+    Segments (already in the output format) are added at their frame offset,
+    the same one AudioSegment.overlay would use, and whatever falls outside
+    the buffer is dropped. Samples are only clipped to the sample range once,
+    when the mix is turned back into samples, instead of on every overlay.
+    """
+    def __init__(self, n_frames, frame_rate, channels, sample_width, first_frame=0):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.first_frame = first_frame
+        # float32 holds sums of 16-bit samples exactly; wider samples need float64
+        self.samples = np.zeros((n_frames, channels), dtype=np.float32 if sample_width <= 2 else np.float64)
+
+    def frame_position(self, position_ms):
+        return int(position_ms * (self.frame_rate / 1000.0))
+
+    def segment_samples(self, segment):
+        return np.frombuffer(segment.raw_data, dtype=SAMPLE_DTYPES[self.sample_width]).reshape(-1, self.channels)
+
+    def add(self, segment, position_ms):
+        self.add_samples(self.segment_samples(segment), self.frame_position(position_ms))
+
+    def add_samples(self, data, start_frame):
+        """Adds (frames, channels) samples starting at an output frame."""
+        start = max(start_frame, self.first_frame)
+        end = min(self.first_frame + len(self.samples), start_frame + len(data))
+        if end > start:
+            self.samples[start - self.first_frame:end - self.first_frame] += data[start - start_frame:end - start_frame]
+
+    def to_bytes(self):
+        dtype = SAMPLE_DTYPES[self.sample_width]
+        limits = np.iinfo(dtype)
+        return np.clip(self.samples, limits.min, limits.max).astype(dtype).tobytes()
+
+    def to_audio_segment(self):
+        return AudioSegment(data=self.to_bytes(), sample_width=self.sample_width, frame_rate=self.frame_rate,
+                            channels=self.channels)
+
+class StreamingMix:
+    """
+    The output mixed and written to a WAV file one block at a time.
+
+    Segments must be added in order of position. A block is mixed (see
+    MixBus) and written as soon as a segment starts past its end, since no
+    later segment can reach it any more, and segments are dropped once they
+    end before the next block. Memory is then bounded by the block size and
+    the segments overlapping one block, not by the length of the output.
+    The file is the same one AudioSegment.export would write.
+    """
+    def __init__(self, path, n_frames, frame_rate, channels, sample_width, block_frames):
+        self.n_frames = n_frames
+        self.block_frames = max(1, block_frames)
+        self.block = MixBus(0, frame_rate, channels, sample_width)
+        self.first_frame = 0
+        self.blocks = 0
+        self._active = []
+        self._out = wave.open(path, 'wb')
+        self._out.setnchannels(channels)
+        self._out.setsampwidth(sample_width)
+        self._out.setframerate(frame_rate)
+
+    def add(self, segment, position_ms):
+        start = self.block.frame_position(position_ms)
+        while self.first_frame < self.n_frames and start >= self.first_frame + self.block_frames:
+            self._write_block()
+        if start < self.n_frames and len(segment.raw_data):
+            self._active.append((start, self.block.segment_samples(segment)))
+
+    def _write_block(self):
+        n_frames = min(self.block_frames, self.n_frames - self.first_frame)
+        block = MixBus(n_frames, self.block.frame_rate, self.block.channels, self.block.sample_width, self.first_frame)
+        for start, data in self._active:
+            block.add_samples(data, start)
+        self._out.writeframesraw(block.to_bytes())
+        self.first_frame += n_frames
+        self.blocks += 1
+        self._active = [(start, data) for start, data in self._active if start + len(data) > self.first_frame]
+
+    def close(self):
+        """Writes the remaining blocks and closes the file."""
+        try:
+            while self.first_frame < self.n_frames:
+                self._write_block()
+        finally:
+            self._out.close()
+
+class SourceCache:
+    """
+    Decoded source files, shared by all the splice lines that use them.
+
+    Each file is decoded once and kept until the cached audio exceeds
+    max_bytes, evicting the least recently used file first. Once the output
+    format is known (set_format), files are converted to it the next time
+    they are used and kept converted, so frame rate, channels and sample width
+    are normalized once per file rather than once per segment.
+
+    With an executor, prefetch() decodes (and converts) upcoming files in the
+    background; get() then waits for them. Only get() touches the cache
+    itself, so it is used from one thread.
+    """
+    def __init__(self, max_bytes, executor=None):
+        self.max_bytes = max_bytes
+        self.executor = executor
+        self.format = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._bytes = 0
+
+    def set_format(self, frame_rate, channels, sample_width):
+        self.format = (frame_rate, channels, sample_width)
+
+    def _in_format(self, audio):
+        return self.format is None or (audio.frame_rate, audio.channels, audio.sample_width) == self.format
+
+    def _load(self, filename, audio=None, audio_format=None):
+        """Decodes a file (unless its audio is given) and converts it to audio_format, if any."""
+        if audio is None:
+            audio = AudioSegment.from_file(filename)
+        if audio_format is not None:
+            frame_rate, channels, sample_width = audio_format
+            audio = audio.set_channels(channels).set_frame_rate(frame_rate).set_sample_width(sample_width)
+        return audio
+
+    def prefetch(self, filenames):
+        """Starts decoding (or converting) the given files on the executor, unless they are ready or under way."""
+        if self.executor is None:
+            return
+        for filename in filenames:
+            if filename in self._pending:
+                continue
+            audio = self._entries.get(filename)
+            if audio is None or not self._in_format(audio):
+                self._pending[filename] = self.executor.submit(self._load, filename, audio, self.format)
+
+    def get(self, filename):
+        """Returns the decoded file (in the output format, if set). Raises what AudioSegment.from_file raises."""
+        if filename in self._pending:
+            # A prefetched decode counts as a miss, a prefetched conversion as a hit
+            if filename in self._entries:
+                self.hits += 1
+            else:
+                self.misses += 1
+            audio = self._pending.pop(filename).result()
+            self._store(filename, audio)
+        elif filename in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(filename)
+            audio = self._entries[filename]
+        else:
+            self.misses += 1
+            audio = self._load(filename)
+            self._store(filename, audio)
+
+        if not self._in_format(audio):
+            audio = self._load(filename, audio, self.format)
+            self._store(filename, audio)
+        return audio
+
+    def _store(self, filename, audio):
+        if filename in self._entries:
+            self._bytes -= len(self._entries.pop(filename).raw_data)
+        self._entries[filename] = audio
+        self._bytes += len(audio.raw_data)
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.raw_data)
+
+class SourceInfo:
+    """
+    Format and length of a source file, as decoding it with pydub would give
+    them, and whether it can be read partially (see SourceReader).
+    """
+    def __init__(self, frame_rate, channels, sample_width, frame_count, partial):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frame_count = frame_count
+        self.partial = partial
+
+    def __len__(self):
+        """Length in ms, as len() of the decoded AudioSegment."""
+        return round(1000 * (self.frame_count / self.frame_rate))
+
+    def slice_frames(self, start_ms, end_ms, frame_rate=None):
+        """First frame and number of frames of audio[start_ms:end_ms], as AudioSegment slicing computes them (at frame_rate, if given)."""
+        frame_rate = frame_rate or self.frame_rate
+        first = int(min(start_ms, len(self)) * (frame_rate / 1000.0))
+        last = int(min(end_ms, len(self)) * (frame_rate / 1000.0))
+        return first, last - first
+
+class SourceReader:
+    """
+    Reads the segments of the source files.
+
+    The format and length of a file come from its header (soundfile, or
+    ffprobe for the formats soundfile cannot read), so planning decodes
+    nothing; only files without a usable header are decoded to learn them.
+    For ffprobe, the length is the reported duration, which can be off by a
+    few ms for compressed formats.
+
+    Files that soundfile can seek in and whose samples pydub would load
+    unchanged (16, 24 and 32-bit PCM in WAV, AIFF, FLAC, ...) are never
+    decoded whole: only the frames of each segment are read, plus a small
+    margin when they have to be resampled. Every other file, and every file
+    with partial=False, is decoded whole through the SourceCache when its
+    segments are mixed.
+    """
+    def __init__(self, cache, partial=True):
+        self.cache = cache
+        self.partial = partial
+        self.partial_reads = 0
+        self._info = {}
+
+    def _probe(self, filename):
+        """Returns the SourceInfo of a file from its header, or None if it has no usable one."""
+        try:
+            with sf.SoundFile(filename) as f:
+                if f.subtype in DECODED_SAMPLE_WIDTHS:
+                    partial = self.partial and f.seekable() and f.subtype in PARTIAL_READ_SUBTYPES
+                    return SourceInfo(f.samplerate, f.channels, DECODED_SAMPLE_WIDTHS[f.subtype], f.frames, partial)
+        except (sf.SoundFileError, OSError):
+            pass
+        return self._probe_ffprobe(filename)
+
+    def _probe_ffprobe(self, filename):
+        """Returns the SourceInfo of a file from ffprobe, working out the sample width as AudioSegment.from_file does."""
+        try:
+            info = mediainfo_json(filename)
+            stream = next(stream for stream in info['streams'] if stream['codec_type'] == 'audio')
+            if stream.get('sample_fmt') == 'fltp' and stream.get('codec_name') in FLTP_16_BIT_CODECS:
+                bits = 16
+            else:
+                bits = int(stream['bits_per_sample'])
+            frame_rate = int(stream['sample_rate'])
+            duration_s = float(stream.get('duration') or info['format']['duration'])
+        except Exception:
+            return None
+        if bits not in (8, 16, 24, 32):
+            # pydub could not decode it either; leave the error to the decode
+            return None
+        return SourceInfo(frame_rate, int(stream['channels']), 4 if bits == 24 else bits // 8,
+                          int(round(duration_s * frame_rate)), False)
+
+    def info(self, filename):
+        """Returns the SourceInfo of a file. Raises what AudioSegment.from_file raises."""
+        if filename not in self._info:
+            info = self._probe(filename)
+            if info is None:
+                audio = self.cache.get(filename)
+                info = SourceInfo(audio.frame_rate, audio.channels, audio.sample_width, int(audio.frame_count()), False)
+            self._info[filename] = info
+        return self._info[filename]
+
+    def probe(self, filenames):
+        """Reads the headers of the files, without decoding anything."""
+        for filename in filenames:
+            if filename not in self._info:
+                info = self._probe(filename)
+                if info is not None:
+                    self._info[filename] = info
+
+    def probed(self, filename):
+        """Whether the format and length of a file are known."""
+        return filename in self._info
+
+    def needs_decode(self, filename):
+        """Whether a file is decoded whole, as far as is known without decoding it."""
+        info = self._info.get(filename)
+        return info is None or not info.partial
+
+    def _read_frames(self, filename, info, first, frames):
+        """Reads frames from a partially readable file into an AudioSegment in its own format, padding with silence past the end."""
+        dtype = SAMPLE_DTYPES[info.sample_width]
+        with sf.SoundFile(filename) as f:
+            f.seek(first)
+            samples = f.read(frames, dtype=np.dtype(dtype).name, always_2d=True)
+            if f.subtype == 'PCM_24':
+                # pydub widens negative 24-bit samples with a 0xFF low byte
+                samples[samples < 0] |= 0xFF
+        if len(samples) < frames:
+            samples = np.concatenate([samples, np.zeros((frames - len(samples), info.channels), dtype=dtype)])
+        return AudioSegment(samples.tobytes(), frame_rate=info.frame_rate, sample_width=info.sample_width, channels=info.channels)
+
+    def segment(self, filename, start_ms, end_ms):
+        """Returns audio[start_ms:end_ms] of a file, in the cache's output format."""
+        info = self.info(filename)
+        if not info.partial:
+            return self.cache.get(filename)[start_ms:end_ms]
+
+        self.partial_reads += 1
+        first, frames = info.slice_frames(start_ms, end_ms)
+        frame_rate, channels, sample_width = self.cache.format
+        if info.frame_rate == frame_rate:
+            return self._read_frames(filename, info, first, frames).set_channels(channels).set_sample_width(sample_width)
+
+        # Resample a slightly larger window, starting on a frame that falls on an output frame so
+        # the resampler is in phase with a whole-file resample, then keep the frames it would have had.
+        # The window stops at the end of the file, as the whole-file resample does, rather than
+        # running on into silence that would leak into the last output frames.
+        step = info.frame_rate // math.gcd(info.frame_rate, frame_rate)
+        margin = int(PARTIAL_READ_MARGIN_MS * (info.frame_rate / 1000.0))
+        window_first = max(0, first - margin) // step * step
+        window_end = min(info.frame_count, first + frames + margin)
+        window = self._read_frames(filename, info, window_first, window_end - window_first)
+        window = window.set_channels(channels).set_frame_rate(frame_rate).set_sample_width(sample_width)
+        out_first, out_frames = info.slice_frames(start_ms, end_ms, frame_rate)
+        offset = out_first - window_first // step * (frame_rate // math.gcd(info.frame_rate, frame_rate))
+        data = window.raw_data[offset * window.frame_width:(offset + out_frames) * window.frame_width]
+        data += bytes(out_frames * window.frame_width - len(data))
+        return AudioSegment(data, frame_rate=frame_rate, sample_width=sample_width, channels=channels)
+
 def parse_line(line_number, line_content):
     """
     Parses a single line from the input file.
@@ -59,12 +415,29 @@ def main():
     """
     Main function to process audio segments and generate the output file.
     """
-    processed_segments_info = []
-    max_output_end_time_ms = 0.0
+    parser = argparse.ArgumentParser(description="Splices segments of audio files, listed one per line on stdin, into output.wav.")
+    parser.add_argument('--cache-mb', type=float, default=DEFAULT_CACHE_MB, help=f"Memory limit for decoded source files kept for reuse by later lines, in MB. Default: {DEFAULT_CACHE_MB}")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of source files decoded concurrently, ahead of the line being processed. Default: 1")
+    parser.add_argument('--stream', action='store_true', help="Mix and write the output block by block, in order of output start time, so memory does not grow with the length of the output.")
+    parser.add_argument('--block-seconds', type=float, default=DEFAULT_BLOCK_SECONDS, help=f"Length of the blocks written by --stream, in seconds. Default: {DEFAULT_BLOCK_SECONDS}")
+    parser.add_argument('--full-decode', action='store_true', help="Decode every source file whole, even those whose segments could be read on their own.")
+    args = parser.parse_args()
 
-    print("Starting audio processing...", file=sys.stderr)
+    if args.jobs < 1:
+        print("Error: --jobs must be at least 1.", file=sys.stderr)
+        return
+    if args.block_seconds <= 0:
+        print("Error: --block-seconds must be positive.", file=sys.stderr)
+        return
+
+    with ThreadPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else contextlib.nullcontext() as executor:
+        cache = SourceCache(int(args.cache_mb * 1024 * 1024), executor=executor)
+        render(args, SourceReader(cache, partial=not args.full_decode), args.jobs)
 
-    for i, line_raw in enumerate(sys.stdin):
+def read_splice_list(lines):
+    """Parses the whole splice list. Returns the valid lines, in order."""
+    splices = []
+    for i, line_raw in enumerate(lines):
         line_num = i + 1
         line = line_raw.strip()
 
@@ -73,9 +446,51 @@ def main():
             continue
 
         parsed_data = parse_line(line_num, line)
-        if not parsed_data:
+        if parsed_data:
+            splices.append(parsed_data)
+    return splices
+
+def upcoming_files(filenames, jobs):
+    """
+    For each position in a list of filenames, the files to have decoding at
+    that point: the file itself and those first used next, up to jobs files.
+    None stands for a file that is not decoded.
+    """
+    order, first_use = [], {}
+    for filename in filenames:
+        if filename is not None and filename not in first_use:
+            first_use[filename] = len(order)
+            order.append(filename)
+    windows, seen = [], -1
+    for filename in filenames:
+        if filename is None:
+            windows.append([])
             continue
+        seen = max(seen, first_use[filename])
+        windows.append([filename] + order[seen + 1:seen + jobs])
+    return windows
 
+def render(args, reader, jobs):
+    """
+    Plans every line of the splice list read from stdin, then mixes the
+    segments into output.wav. Distinct files that have to be decoded whole
+    are decoded up to `jobs` at a time, ahead of the line that needs them.
+    """
+    cache = reader.cache
+    planned_segments = []
+    output_format = (OUTPUT_FRAME_RATE, OUTPUT_CHANNELS, OUTPUT_SAMPLE_WIDTH)
+    max_output_end_time_ms = 0.0
+
+    print("Starting audio processing...", file=sys.stderr)
+
+    # The whole list is read first, so the files can be decoded concurrently
+    splices = read_splice_list(sys.stdin)
+    filenames = [splice["filename"] for splice in splices]
+    # Reading the headers first leaves only the files without a usable one to decode while planning
+    reader.probe(filenames)
+    for parsed_data, upcoming in zip(splices, upcoming_files([None if reader.probed(f) else f for f in filenames], jobs)):
+        cache.prefetch(upcoming)
+        line_num = parsed_data["line_number"]
         filename = parsed_data["filename"]
         start_ms = parsed_data["start_ms"]
         duration_ms = parsed_data["duration_ms"]
@@ -85,7 +500,7 @@ def main():
         print(f"Processing line {line_num}: file='{filename}', start={start_ms/1000:.2f}s, dur={duration_ms/1000:.2f}s, out_start={outputstart_ms/1000:.2f}s, angle={cut_angle_deg}deg", file=sys.stderr)
 
         try:
-            audio_file = AudioSegment.from_file(filename)
+            source = reader.info(filename)
         except FileNotFoundError:
             print(f"Error: Line {line_num}: Audio file '{filename}' not found. Skipping.", file=sys.stderr)
             continue
@@ -97,21 +512,23 @@ def main():
             continue
         
         # Ensure slice start is within bounds
-        if start_ms >= len(audio_file):
-            print(f"Warning: Line {line_num}: Start time ({start_ms/1000:.2f}s) is at or beyond the duration of '{filename}' ({len(audio_file)/1000:.2f}s). Skipping segment.", file=sys.stderr)
+        if start_ms >= len(source):
+            print(f"Warning: Line {line_num}: Start time ({start_ms/1000:.2f}s) is at or beyond the duration of '{filename}' ({len(source)/1000:.2f}s). Skipping segment.", file=sys.stderr)
             continue
         
         # Calculate actual duration to extract, capped by file length
-        actual_duration_ms = min(duration_ms, len(audio_file) - start_ms)
+        actual_duration_ms = min(duration_ms, len(source) - start_ms)
         
         if actual_duration_ms <= 0:
              print(f"Warning: Line {line_num}: Calculated effective duration for '{filename}' is zero or negative. Skipping segment.", file=sys.stderr)
              continue
 
-        segment = audio_file[start_ms : start_ms + actual_duration_ms]
+        _, segment_frames = source.slice_frames(start_ms, start_ms + actual_duration_ms)
+        segment_len_ms = round(1000 * (segment_frames / source.frame_rate))
 
-        # Apply fade based on cut_angle
+        # Work out the fade for the cut_angle; it is applied when the segment is mixed
         fade_duration_ms = 0.0
+        applied_fade_ms = 0
         if not (0 < cut_angle_deg <= 90.0):
             if cut_angle_deg != 90.0: # Only warn if it's not the default or explicitly 90 but invalid
                  print(f"Info: Line {line_num}: Cut angle {cut_angle_deg}deg is outside the effective range (0 < angle <= 90). Treating as 90 degrees (no fade).", file=sys.stderr)
@@ -121,50 +538,84 @@ def main():
             fade_duration_ms = MAX_FADE_EFFECT_MS * fade_ratio
         
         if fade_duration_ms > 0:
-            actual_segment_len_ms = len(segment)
-            if actual_segment_len_ms == 0:
+            if segment_len_ms == 0:
                 print(f"Warning: Line {line_num}: Segment from '{filename}' has zero length after slicing. Skipping fade.", file=sys.stderr)
             else:
                 # Ensure fade is not longer than half the segment length
-                effective_fade_ms = min(fade_duration_ms, actual_segment_len_ms / 2.0)
+                effective_fade_ms = min(fade_duration_ms, segment_len_ms / 2.0)
                 if effective_fade_ms > 0.5: # Apply if fade is at least somewhat significant
                     print(f"Info: Line {line_num}: Applying {int(round(effective_fade_ms))}ms fade-in/out for angle {cut_angle_deg}deg.", file=sys.stderr)
-                    segment = segment.fade_in(duration=int(round(effective_fade_ms))).fade_out(duration=int(round(effective_fade_ms)))
+                    applied_fade_ms = int(round(effective_fade_ms))
                 else:
                     print(f"Info: Line {line_num}: Calculated fade ({effective_fade_ms:.2f}ms) too short for angle {cut_angle_deg}deg. No fade applied.", file=sys.stderr)
         
-        processed_segments_info.append({
-            "segment": segment,
+        planned_segments.append({
+            "filename": filename,
+            "start_ms": start_ms,
+            "duration_ms": actual_duration_ms,
+            "fade_ms": applied_fade_ms,
             "outputstart_ms": outputstart_ms,
             "line_num": line_num
         })
+        # The output takes the highest frame rate, channel count and sample width of its segments
+        output_format = tuple(max(a, b) for a, b in zip(output_format, (source.frame_rate, source.channels, source.sample_width)))
         
-        current_segment_end_time_ms = outputstart_ms + len(segment)
+        current_segment_end_time_ms = outputstart_ms + segment_len_ms
         if current_segment_end_time_ms > max_output_end_time_ms:
             max_output_end_time_ms = current_segment_end_time_ms
 
-    if not processed_segments_info:
+    if not planned_segments:
         print("No valid audio segments processed. Output file 'output.wav' will not be generated.", file=sys.stderr)
         return
 
     print(f"All lines processed. Total output duration will be: {max_output_end_time_ms / 1000.0:.2f}s.", file=sys.stderr)
     
-    # Ensure duration is an integer for AudioSegment.silent
+    # Ensure duration is an integer number of milliseconds, as AudioSegment.silent would
+    frame_rate, channels, sample_width = output_format
     final_output_duration_ms = int(round(max_output_end_time_ms))
     if final_output_duration_ms <= 0:
          print("Warning: Final output duration is zero. 'output.wav' will be empty or not generated correctly.", file=sys.stderr)
-         # Create a minimal silent segment if needed by export, or handle as Pydub prefers
-         output_audio = AudioSegment.empty() 
+    n_frames = int(frame_rate * (max(0, final_output_duration_ms) / 1000.0))
+    streaming = args.stream and final_output_duration_ms > 0
+    if streaming:
+        # Segments are mixed in output order, so finished blocks can be written as they come
+        planned_segments.sort(key=lambda info: info["outputstart_ms"])
+        try:
+            mix = StreamingMix("output.wav", n_frames, frame_rate, channels, sample_width, int(args.block_seconds * frame_rate))
+        except Exception as e:
+            print(f"Error exporting output.wav: {e}", file=sys.stderr)
+            return
     else:
-        output_audio = AudioSegment.silent(duration=final_output_duration_ms)
+        # Every segment is mixed into this buffer, in the final format
+        mix = MixBus(n_frames, frame_rate, channels, sample_width)
+
+    # From here on, sources come out of the cache already converted to the output format
+    cache.set_format(frame_rate, channels, sample_width)
+    decoded = [info["filename"] if reader.needs_decode(info["filename"]) else None for info in planned_segments]
+    for info, upcoming in zip(planned_segments, upcoming_files(decoded, jobs)):
+        cache.prefetch(upcoming)
+        try:
+            segment = reader.segment(info["filename"], info["start_ms"], info["start_ms"] + info["duration_ms"])
+        except Exception as e:
+            print(f"Error: Line {info['line_num']}: Reloading audio file '{info['filename']}' failed: {e}. Skipping.", file=sys.stderr)
+            continue
+        if info["fade_ms"]:
+            segment = segment.fade_in(duration=info["fade_ms"]).fade_out(duration=info["fade_ms"])
 
+        print(f"Mixing segment from line {info['line_num']} at {info['outputstart_ms']/1000:.2f}s.", file=sys.stderr)
+        mix.add(segment, int(round(info["outputstart_ms"])))
 
-    for info in processed_segments_info:
-        print(f"Overlaying segment from line {info['line_num']} at {info['outputstart_ms']/1000:.2f}s.", file=sys.stderr)
-        output_audio = output_audio.overlay(info["segment"], position=int(round(info["outputstart_ms"])))
+    print(f"Source cache: {cache.hits} hits, {cache.misses} misses (decodes). Partial reads: {reader.partial_reads}.", file=sys.stderr)
 
     try:
-        output_audio.export("output.wav", format="wav")
+        if streaming:
+            mix.close()
+            print(f"Wrote {mix.blocks} blocks of up to {args.block_seconds:.2f}s.", file=sys.stderr)
+        elif final_output_duration_ms <= 0:
+            # Create a minimal silent segment if needed by export, or handle as Pydub prefers
+            AudioSegment.empty().export("output.wav", format="wav")
+        else:
+            mix.to_audio_segment().export("output.wav", format="wav")
         print("Successfully generated output.wav", file=sys.stdout) # Final confirmation to stdout
     except Exception as e:
         print(f"Error exporting output.wav: {e}", file=sys.stderr)
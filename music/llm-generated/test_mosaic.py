@@ -0,0 +1,55 @@
+"""
+Tests for mosaic.py. Run with: python -m pytest test_mosaic.py
+"""
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import mosaic
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mosaic.py')
+SR = 22050
+
+def write_percussive(path, seconds=12, seed=0):
+    """Writes decaying noise bursts with a passage 80 dB quieter in the middle: a high dynamic range."""
+    rng = np.random.default_rng(seed)
+    y = np.zeros(SR * seconds, dtype=np.float32)
+    for start in range(0, len(y), SR // 2):
+        length = min(4000, len(y) - start)
+        y[start:start + length] += 0.9 * rng.standard_normal(length) * np.exp(-np.arange(length) / 400.0)
+    y[len(y) // 2:len(y) * 3 // 4] *= 1e-4
+    sf.write(path, y, SR, subtype='PCM_16')
+    return path
+
+@pytest.fixture
+def percussive(tmp_path):
+    return write_percussive(str(tmp_path / 'percussive.wav'))
+
+@pytest.mark.parametrize('extractor', sorted(mosaic.FEATURE_EXTRACTORS))
+def test_split_analysis_matches_whole_file(percussive, extractor):
+    whole = mosaic.analyze_files([percussive], 0.1, 0.4, SR, rng=np.random.default_rng(0), extractor=extractor)[0]
+    split = mosaic.analyze_files([percussive], 0.1, 0.4, SR, rng=np.random.default_rng(0), jobs=2, split_s=3,
+                                 extractor=extractor)[0]
+    np.testing.assert_array_equal(split.features, whole.features)
+
+def test_jobs_do_not_change_output(percussive, tmp_path):
+    outputs = []
+    for jobs in (1, 2):
+        output = str(tmp_path / f'jobs{jobs}.wav')
+        subprocess.run([sys.executable, SCRIPT, '-r', percussive, '-s', percussive, '-o', output, '--seed', '1',
+                        '--extractor', 'fast', '--jobs', str(jobs), '--split-seconds', '3'],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        outputs.append(sf.read(output)[0])
+    np.testing.assert_array_equal(outputs[1], outputs[0])
+
+@pytest.mark.parametrize('extractor', sorted(mosaic.FEATURE_EXTRACTORS))
+def test_stream_analysis_matches_whole_file(percussive, extractor):
+    whole = mosaic.analyze_file(percussive, 0.1, 0.4, SR, rng=np.random.default_rng(0), extractor=extractor)
+    streamed = mosaic.analyze_file_stream(percussive, 0.1, 0.4, SR, window_s=3, rng=np.random.default_rng(0),
+                                          extractor=extractor)
+    np.testing.assert_allclose(streamed.features, whole.features, rtol=1e-5, atol=1e-3)